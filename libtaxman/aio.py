@@ -0,0 +1,52 @@
+#
+# This is the shared asyncio event loop that AsyncBaseCollector plugins are
+# run on
+#
+
+from concurrent.futures import Future
+from threading import Thread
+from typing import Coroutine
+
+import asyncio
+import logging
+
+
+class EventLoopThread(Thread):
+    """
+    Runs a single asyncio event loop in a background thread.  Coroutines
+    are handed to it from other threads with submit()
+    """
+    def __init__(self):
+        super().__init__(name='asyncio')
+        self.daemon = True
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self._cancel_all()
+            self.loop.close()
+
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        Schedule the coroutine on the loop.  This is thread safe
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def _cancel_all(self):
+        """
+        Cancel anything left running when the loop is stopped
+        """
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+
+        if tasks:
+            logging.debug(f'Cancelling {len(tasks)} outstanding async tasks')
+            self.loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
@@ -1,59 +1,718 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 from configparser import ConfigParser, SectionProxy
-from gdata_subm import Gdata
-from threading import Thread, Event
-from queue import Queue
-from typing import List, Union
+from libtaxman.config import get_opts
+from libtaxman.errors import InvalidConfig
+from libtaxman.partition import get_membership, owner, shard_of
+from libtaxman.scheduler import (
+    MISSED_RUN_POLICIES,
+    PHASE_MODES,
+    PRIORITIES,
+    adapt_interval,
+    align_offset,
+    next_run,
+)
+from threading import Thread, Event, Lock
+from queue import Full, Queue
+from typing import Iterator, List, Tuple, Union, TYPE_CHECKING
+import inspect
 import logging
 import time
 
+if TYPE_CHECKING:
+    # This is only needed for the annotations
+    from gdata_subm import Gdata
+
+# What to do when a run is due while the previous run is still going:
+#   skip    - don't start a new run
+#   queue   - start one more run as soon as the current one finishes
+#   abandon - discard the results of the stale run and start a new one (for
+#             a thread, at the first due run after the stale run returns)
+OVERRUN_POLICIES = ('skip', 'queue', 'abandon')
+
+
+def as_list(data) -> List[Gdata]:
+    """
+    Returns what a collector returned (or yielded) as a list of Gdata
+    """
+    if data is None:
+        return []
+
+    if isinstance(data, (tuple, list)):
+        return list(data)
+
+    return [data]
+
+
+def count_data(data) -> Tuple[int, int]:
+    """
+    Returns the number of Gdata records and the total number of values in
+    what a collector returned
+    """
+    data = as_list(data)
+
+    return (len(data), sum(len(gd.values) for gd in data))
+
+
+def values_changed(old: dict, new: dict, threshold: float) -> bool:
+    """
+    Compare 2 snapshots of a plugin's values, as returned by snapshot().
+    Numbers only count as changed if they moved by more than the threshold,
+    as a fraction of the old value
+    """
+    if old.keys() != new.keys():
+        return True
+
+    for key, values in new.items():
+        if len(values) != len(old[key]):
+            return True
+
+        for a, b in zip(old[key], values):
+            if a == b:
+                continue
+
+            try:
+                if abs(b - a) > threshold * abs(a):
+                    return True
+            except TypeError:
+                return True
+
+    return False
+
+
+def snapshot(data) -> dict:
+    """
+    Returns the values in what a collector returned, keyed on what they are
+    """
+    return {
+        (
+            gd.plugin, gd.plugin_instance, gd.dtype, gd.dtype_instance,
+            gd.host, tuple(gd.dsnames or ()),
+        ): list(gd.values)
+        for gd in as_list(data)
+    }
+
 
 class BaseCollector(Thread):
     """
     This is the base collector class that should be used for plugins
     """
+    # The per-run deadline, in seconds, when one isn't configured.  None means
+    # runs can take as long as they like
+    DEFAULT_TIMEOUT = None
+    # The typed options for the plugin, as a sequence of config.Option.  These
+    # are validated and converted once and available as self.opts
+    SCHEMA = ()
+    # These options only affect scheduling, so they can be changed on a
+    # running collector with reconfigure()
+    SCHED_OPTS = frozenset((
+        'interval',
+        'timeout',
+        'missed_run_policy',
+        'overrun_policy',
+        'phase',
+        'priority',
+        'adaptive',
+        'adaptive_factor',
+        'adaptive_max',
+        'adaptive_threshold',
+    ))
+
     def __init__(self, res_q: Queue, config: SectionProxy):
-        super().__init__()
+        super().__init__(name=config.name)
         self.config = config  # This is the relevant section of the config
-        self.next_sched = time.time()
+        self.opts = get_opts(config, self.SCHEMA)
+        self._load_sched_opts()
+        # This is on the monotonic clock so wall clock jumps don't matter
+        self.next_sched = time.monotonic()
+        # Counters of scheduled runs that didn't happen, of runs that were
+        # due while the previous run was still going, of runs skipped while
+        # the submitter was behind and of results that didn't fit in the
+        # submission queue
+        self.missed = 0
+        self.overruns = 0
+        self.deferred = 0
+        self.dropped = 0
+        self.last_duration = None
+        # Stats for the last completed run.  The CPU time is for this
+        # collector's thread (or worker process) only, so it doesn't include
+        # any subprocesses it runs
+        self.last_cpu = None
+        self.last_records = 0
+        self.last_values = 0
+        self.last_error = None
         self.run_ev = Event()
         self._res_q = res_q
         self.daemon = True
         self._stop = Event()
+        # When get_data_for_sub() is a generator, this is how many records
+        # are queued for submission at a time
+        self.stream_chunk = config.getint('stream_chunk', 100)
+        self._run_records = 0
+        self._run_values = 0
+        # The values from the current and the last run, for the adaptive
+        # interval
+        self._run_snapshot = {}
+        self._last_snapshot = None
+        # This is set by the manager to be told when the adaptive interval
+        # snaps back, with when the next run should now be
+        self.on_snap_back = None
+        # When a plugin's targets are split into shards, this instance only
+        # checks the targets in its own shard
+        self.shard = config.getint('shard', 0)
+        self.shards = config.getint('shards', 1)
+        # When the targets are split across taxman nodes, this is the id of
+        # this node and the list of all of them
+        self.membership = None
+        if config.parser.has_section('main'):
+            self.membership = get_membership(config.parser['main'])
+        # The state of the current run.  _gen is bumped whenever a run is
+        # abandoned so its results can be recognized and dropped, and _stale
+        # is set while a thread is still stuck in the abandoned run
+        self._state_lock = Lock()
+        self._running = False
+        self._run_start = 0.0
+        self._queued = False
+        self._gen = 0
+        self._stale = False
 
     def run(self):
         while not self._stop.is_set():
             # Wait for the run event
             self.run_ev.wait()
+            if self._stop.is_set():
+                break
             # Reset the run event
             self.run_ev.clear()
+            self.collect()
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start_run(self, now: float = None) -> bool:
+        """
+        This is called when a run is due.  It applies the timeout and the
+        overrun policy to any run still in progress and returns whether
+        a new run should be started
+        """
+        now = time.monotonic() if now is None else now
+        with self._state_lock:
+            if self._running:
+                self.overruns += 1
+                if self._stale:
+                    # Only one run at a time can be abandoned, so a hung
+                    # plugin can't tie up more than one thread
+                    logging.warning(
+                        f'{self.name} is still stuck in an abandoned run, '
+                        'skipping this run'
+                    )
+                    self.missed += 1
+                    return False
+                elif self.timeout is not None and \
+                        now - self._run_start > self.timeout:
+                    logging.warning(
+                        f'{self.name} exceeded its {self.timeout}s timeout, '
+                        'abandoning the run'
+                    )
+                    self._abandon()
+                elif self.overrun_policy == 'abandon':
+                    logging.warning(
+                        f'{self.name} is still running, abandoning the '
+                        'stale run'
+                    )
+                    self._abandon()
+                elif self.overrun_policy == 'queue' and not self._queued:
+                    logging.info(
+                        f'{self.name} is still running, queueing a run')
+                    self._queued = True
+                    return False
+                else:
+                    logging.warning(
+                        f'{self.name} is still running, skipping this run')
+                    self.missed += 1
+                    return False
+
+                if self._stale:
+                    # The new run waits until the stale one is gone
+                    self.missed += 1
+                    return False
+
+            self._running = True
+            self._run_start = now
+
+            return True
 
+    def collect(self):
+        """
+        Do a collection and queue up the results for submission.  This is
+        called from this collector's own thread or from the manager's shared
+        worker pool, depending on the run mode, after start_run()
+        """
+        with self._state_lock:
+            gen = self._gen
+
+        while True:
+            start = time.monotonic()
+            cpu_start = self._get_cpu_time()
+            self._run_records = self._run_values = 0
+            self._run_snapshot = {}
+            error = None
             try:
                 data = self.get_data_for_sub()
-                if data is not None:
-                    self._res_q.put(data, timeout=1)
+                if inspect.isgenerator(data):
+                    self._stream(gen, data)
+                else:
+                    self._queue_data(gen, data)
             except Exception as e:
+                error = repr(e)
                 logging.error(
                     f'Failed to get stats from {self.__class__.__name__}: {e}')
 
+            self._set_run_stats(cpu_start, error)
+            if not self._finish_run(gen, start):
+                break
+
     def run_now(self):
         """
         This basically triggers a run event for the thread
         """
         logging.debug(f'A run has been scheduled in: {self.__class__.__name__}')
         self.run_ev.set()
-        self.sched_next()
 
     def stop(self):
         self._stop.set()
+        # Wake up the thread so it can exit
+        self.run_ev.set()
+
+    def reconfigure(self, config: SectionProxy) -> bool:
+        """
+        Switch a running collector to a new config section where only the
+        SCHED_OPTS have changed.  This returns False if the collector has to
+        be rebuilt instead.  A bad value raises InvalidConfig and leaves the
+        collector on its old config
+        """
+        self._load_sched_opts(config)
+
+        return True
+
+    def sched_next(self, now: float = None) -> bool:
+        """
+        Advance next_sched past the run that is currently due, applying the
+        missed run policy.  This returns whether the due run should happen
+        """
+        now = time.monotonic() if now is None else now
+        self.next_sched, run, missed = next_run(
+            self.next_sched,
+            self.run_interval,
+            now,
+            self.missed_run_policy,
+        )
+        if missed:
+            self.missed += missed
+            logging.warning(
+                f'{self.name} missed {missed} scheduled run(s), applied the '
+                f'"{self.missed_run_policy}" policy'
+            )
+
+        if self.phase == 'align':
+            # The monotonic clock drifts from the wall clock, so re-align
+            # on every run
+            self.next_sched = now + align_offset(self.run_interval)
+
+        return run
+
+    def owns(self, target: str) -> bool:
+        """
+        Returns whether this instance should check the given target.  Plugins
+        with a list of targets use this to only check their own share
+        """
+        if self.membership is not None:
+            node_id, members = self.membership
+            if owner(target, members) != node_id:
+                return False
 
-    def sched_next(self) -> None:
-        self.next_sched += int(self.config['interval'])
+        return self.shards <= 1 or shard_of(target, self.shards) == self.shard
 
-    def get_data_for_sub(self) -> Union[Gdata, List[Gdata]]:
+    def get_data_for_sub(self) -> Union[Gdata, List[Gdata], Iterator]:
         """
         This is called to get the data for upstream submission and should
-        return a Gdata object
+        return a Gdata object or a list of them.  For large result sets, this
+        can also be a generator that yields Gdata objects (or lists of them)
+        which are submitted in chunks as they are produced
+        """
+        raise NotImplementedError()
+
+    def _stream(self, gen: int, data: Iterator):
+        """
+        Queue up what a generator yields in chunks of stream_chunk records,
+        rather than all at once at the end of the run
+        """
+        chunk = []
+        try:
+            for item in data:
+                chunk.extend(as_list(item))
+                if len(chunk) >= self.stream_chunk:
+                    if not self._queue_data(gen, chunk):
+                        return
+                    chunk = []
+        finally:
+            data.close()
+
+        self._queue_data(gen, chunk)
+
+    def _queue_data(self, gen: int, data) -> bool:
+        """
+        Queue up data for submission, unless the run was abandoned.  This
+        returns False if the run was abandoned
+        """
+        if gen != self._gen:
+            return False
+
+        if not data:
+            return True
+
+        records, values = count_data(data)
+        self._run_records += records
+        self._run_values += values
+        if self.adaptive:
+            self._run_snapshot.update(snapshot(data))
+        try:
+            self._res_q.put(data, timeout=1)
+        except Full:
+            self.dropped += records
+            logging.error(
+                f'Dropped {records} records from {self.name}, the submission '
+                'queue is full'
+            )
+        except Exception as e:
+            logging.error(f'Failed to queue data from {self.name}: {e}')
+
+        return True
+
+    def _finish_run(self, gen: int, start: float) -> bool:
+        """
+        Wrap up a run, unless it was abandoned.  This returns True if a
+        queued run should be started right away
+        """
+        with self._state_lock:
+            if gen != self._gen:
+                logging.warning(
+                    f'Dropping the results of an abandoned run of {self.name}')
+                if self._stale:
+                    # Nothing else was started in the meantime
+                    self._stale = False
+                    self._running = False
+                return False
+
+            self.last_duration = time.monotonic() - start
+            if self._queued:
+                self._queued = False
+                self._run_start = time.monotonic()
+                return True
+
+            self._running = False
+
+        return False
+
+    def _abandon(self):
+        """
+        Forget about the current run.  This must be called with the state
+        lock held
+        """
+        self._gen += 1
+        self._queued = False
+        # A thread can't be stopped, so it's still busy with the stale run
+        self._stale = True
+
+    def _get_cpu_time(self) -> float:
+        return time.thread_time()
+
+    def _set_run_stats(self, cpu_start: float, error: str):
+        self.last_cpu = max(self._get_cpu_time() - cpu_start, 0.0)
+        self.last_records = self._run_records
+        self.last_values = self._run_values
+        self.last_error = error
+        if self.adaptive:
+            self._adapt(error)
+
+    def _adapt(self, error: str):
+        """
+        Stretch the interval while the values aren't changing and snap it
+        back when they do, or when the run failed
+        """
+        stable = error is None and self._last_snapshot is not None and \
+            not values_changed(
+                self._last_snapshot,
+                self._run_snapshot,
+                self.adaptive_threshold,
+            )
+        self._last_snapshot = self._run_snapshot if error is None else None
+
+        cur = self.run_interval
+        self.run_interval = adapt_interval(
+            cur,
+            self.interval,
+            self.adaptive_factor,
+            self.adaptive_max,
+            stable,
+        )
+        if self.run_interval != cur:
+            logging.debug(
+                f'The interval for {self.name} is now {self.run_interval}s')
+        if self.run_interval < cur and self.on_snap_back is not None:
+            # The next run was already scheduled with the stretched interval
+            self.on_snap_back(self._run_start + self.run_interval)
+
+    def _load_sched_opts(self, config: SectionProxy = None):
+        """
+        Load the scheduling options from the config section, or from our own
+        config.  Everything is checked before anything is changed, so a bad
+        value leaves the collector as it was
+        """
+        config = self.config if config is None else config
+        interval = config.getfloat('interval')
+        timeout = config.get('timeout')
+        timeout = float(timeout) if timeout else self.DEFAULT_TIMEOUT
+        missed_run_policy = self._get_policy(
+            config, 'missed_run_policy', 'once', MISSED_RUN_POLICIES)
+        overrun_policy = self._get_policy(
+            config, 'overrun_policy', 'skip', OVERRUN_POLICIES)
+        phase = self._get_policy(config, 'phase', 'none', PHASE_MODES)
+        priority = self._get_policy(
+            config, 'priority', 'normal', tuple(PRIORITIES))
+        adaptive = config.getboolean('adaptive', False)
+        adaptive_factor = config.getfloat('adaptive_factor', 2.0)
+        adaptive_max = config.get('adaptive_max')
+        adaptive_max = float(adaptive_max) if adaptive_max else interval * 8
+        adaptive_threshold = config.getfloat('adaptive_threshold', 0.0)
+
+        self.config = config
+        self.interval = interval
+        self.timeout = timeout
+        self.missed_run_policy = missed_run_policy
+        self.overrun_policy = overrun_policy
+        self.phase = phase
+        self.priority = priority
+        # With an adaptive interval, runs are spaced out further, up to
+        # adaptive_max, while the values aren't changing
+        self.adaptive = adaptive
+        self.adaptive_factor = adaptive_factor
+        self.adaptive_max = adaptive_max
+        self.adaptive_threshold = adaptive_threshold
+        # This is the interval actually used for scheduling
+        self.run_interval = self.interval
+        self._last_snapshot = None
+
+    def _get_policy(
+            self,
+            config: SectionProxy,
+            opt: str,
+            default: str,
+            choices: tuple) -> str:
+        ret = config.get(opt, default)
+        if ret not in choices:
+            raise InvalidConfig(
+                f'Invalid {opt} "{ret}" for {config.name}, must be one '
+                f'of: {choices}'
+            )
+
+        return ret
+
+
+class AsyncBaseCollector(BaseCollector):
+    """
+    This is the base collector class for plugins that use asyncio.  Instead
+    of getting a thread, these are run on the manager's shared event loop
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._task = None
+
+    def run(self):
+        raise RuntimeError(
+            f'{self.name} is an async collector and must not be started as '
+            'a thread'
+        )
+
+    def collect(self):
+        """
+        Do a single collection on a private event loop.  The manager never
+        calls this, but it's handy for running a plugin standalone
+        """
+        import asyncio
+        asyncio.run(self.collect_async())
+
+    async def collect_async(self):
+        """
+        The asyncio equivalent of BaseCollector.collect().  Here, the timeout
+        is actually enforced by cancelling the run
+        """
+        # asyncio is only imported when an async plugin is in use
+        import asyncio
+        with self._state_lock:
+            gen = self._gen
+            self._task = asyncio.current_task()
+
+        while True:
+            start = time.monotonic()
+            # On the shared loop, this also counts anything else that ran on
+            # the loop in the meantime
+            cpu_start = self._get_cpu_time()
+            self._run_records = self._run_values = 0
+            self._run_snapshot = {}
+            error = None
+            try:
+                await asyncio.wait_for(self._collect_data(gen), self.timeout)
+            except asyncio.TimeoutError:
+                error = f'timed out after {self.timeout}s'
+                logging.warning(
+                    f'{self.name} exceeded its {self.timeout}s timeout')
+                with self._state_lock:
+                    self.overruns += 1
+            except asyncio.CancelledError:
+                logging.warning(f'The run of {self.name} was cancelled')
+                break
+            except Exception as e:
+                error = repr(e)
+                logging.error(
+                    f'Failed to get stats from {self.__class__.__name__}: {e}')
+
+            self._set_run_stats(cpu_start, error)
+            if not self._finish_run(gen, start):
+                break
+
+    async def get_data_for_sub(self) -> Union[Gdata, List[Gdata]]:
+        """
+        This is awaited to get the data for upstream submission and should
+        return a Gdata object or a list of them.  This can also be an async
+        generator, which works like a generator in a BaseCollector
+        """
+        raise NotImplementedError()
+
+    async def _collect_data(self, gen: int):
+        data = self.get_data_for_sub()
+        if not inspect.isasyncgen(data):
+            self._queue_data(gen, await data)
+            return
+
+        chunk = []
+        try:
+            async for item in data:
+                chunk.extend(as_list(item))
+                if len(chunk) >= self.stream_chunk:
+                    if not self._queue_data(gen, chunk):
+                        return
+                    chunk = []
+        finally:
+            await data.aclose()
+
+        self._queue_data(gen, chunk)
+
+    def _abandon(self):
+        super()._abandon()
+        # Unlike a thread, the stale run can actually be stopped here, so a
+        # new one can start right away
+        self._stale = False
+        if self._task is not None and not self._task.done():
+            self._task.get_loop().call_soon_threadsafe(self._task.cancel)
+
+
+class PushCollector(BaseCollector):
+    """
+    This is the base collector class for plugins that watch an event source
+    instead of polling on an interval.  watch() runs for as long as the
+    source does and calls emit() whenever there is data.  The manager
+    restarts the watch, with a backoff, whenever it ends.  The interval isn't
+    used, other than by the phase to place the first start
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # emit() blocks while the submission queue is at least this deep
+        self.backlog = self.config.getint('backlog', 1000)
+        # The number of times in a row that the watch ended without emitting
+        # anything
+        self.failures = 0
+        # This is set by the manager to be told when the watch ends
+        self.on_exit = None
+        self._emitted = False
+
+    def run(self):
+        while not self._stop.is_set():
+            self.run_ev.wait()
+            if self._stop.is_set():
+                break
+            self.run_ev.clear()
+            self._watch()
+
+    def start_run(self, now: float = None) -> bool:
+        # There is only ever one watch, so there's nothing to overrun
+        return not self._running
+
+    def collect(self):
+        raise RuntimeError(f'{self.name} is a push collector')
+
+    def run_now(self):
+        self.run_ev.set()
+
+    def emit(self, data: Union[Gdata, List[Gdata]]) -> bool:
+        """
+        Queue up data for submission right away.  If the submitter is
+        falling behind, this blocks until it catches up, which in turn slows
+        down the watch.  This returns False if the collector is stopping
+        """
+        while not self._stop.is_set():
+            if self._res_q.qsize() < self.backlog:
+                try:
+                    self._res_q.put(data, timeout=0.1)
+                except Full:
+                    continue
+
+                self._emitted = True
+                records, values = count_data(data)
+                self._run_records += records
+                self._run_values += values
+                return True
+
+            self._stop.wait(0.1)
+
+        return False
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop.is_set()
+
+    def watch(self):
+        """
+        Watch the event source and emit() data as it comes in.  This should
+        return when the source ends or stopping is set.  A subclass that
+        blocks on its source should also override stop() to interrupt it
         """
         raise NotImplementedError()
+
+    def _watch(self):
+        logging.info(f'Starting the watch for {self.name}')
+        start = time.monotonic()
+        cpu_start = self._get_cpu_time()
+        self._run_records = self._run_values = 0
+        self._emitted = False
+        self._running = True
+        error = None
+        try:
+            self.watch()
+        except Exception as e:
+            error = repr(e)
+            logging.exception(f'The watch for {self.name} failed')
+        finally:
+            self._running = False
+            self.last_duration = time.monotonic() - start
+            self._set_run_stats(cpu_start, error)
+
+        if self._stop.is_set():
+            return
+
+        self.failures = 0 if self._emitted else self.failures + 1
+        if self.on_exit is not None:
+            self.on_exit()
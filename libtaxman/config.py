@@ -1,7 +1,160 @@
 
-from configparser import ConfigParser
+from configparser import ConfigParser, SectionProxy
+from dataclasses import dataclass
+from libtaxman.errors import InvalidConfig
+from types import SimpleNamespace
+from typing import Any, Callable, Iterable, List
+
+import re
+
+# The default for an Option that has to be set
+REQUIRED = object()
+
+
+@dataclass(frozen=True)
+class Option:
+    """
+    A typed plugin option.  The raw string from the config is turned into
+    its value with conv, and a missing or empty option gets the default
+    """
+    name: str
+    conv: Callable[[str], Any] = str
+    default: Any = REQUIRED
+
+
+def to_bool(raw: str) -> bool:
+    if raw.lower() not in ConfigParser.BOOLEAN_STATES:
+        raise ValueError(f'Not a boolean: {raw}')
+
+    return ConfigParser.BOOLEAN_STATES[raw.lower()]
+
+
+def to_list(raw: str) -> List[str]:
+    """
+    A list of whitespace separated items, ie. 1 per line
+    """
+    return raw.split()
+
+
+def to_lines(raw: str) -> List[str]:
+    """
+    A list of the non-empty lines, for items that can have spaces in them
+    """
+    return [s.strip() for s in raw.split('\n') if s.strip()]
+
+
+def one_of(*choices: str) -> Callable[[str], str]:
+    """
+    Returns a converter for an option that has to be one of the choices
+    """
+    def conv(raw: str) -> str:
+        if raw not in choices:
+            raise ValueError(f'must be one of: {choices}')
+
+        return raw
+
+    return conv
+
+
+def at_least(minimum: int) -> Callable[[str], int]:
+    """
+    Returns a converter for an integer option with a lower bound
+    """
+    def conv(raw: str) -> int:
+        ret = int(raw)
+        if ret < minimum:
+            raise ValueError(f'must be at least {minimum}')
+
+        return ret
+
+    return conv
+
+
+def split_on(sep: str) -> Callable[[str], List[str]]:
+    """
+    Returns a converter for a list of items separated by sep
+    """
+    def conv(raw: str) -> List[str]:
+        return [s.strip() for s in raw.split(sep) if s.strip()]
+
+    return conv
+
+
+def get_opts(section: SectionProxy, schema: Iterable[Option]):
+    """
+    Validate and convert the options in the schema for a plugin section.
+    This returns a namespace of the converted values, so plugins don't have
+    to parse strings on every run
+    """
+    ret = SimpleNamespace()
+    for opt in schema:
+        raw = section.get(opt.name)
+        if raw is None or not raw.strip():
+            if opt.default is REQUIRED:
+                raise InvalidConfig(
+                    f'The "{opt.name}" option must be set for {section.name}')
+
+            setattr(ret, opt.name, opt.default)
+            continue
+
+        try:
+            setattr(ret, opt.name, opt.conv(raw.strip()))
+        except Exception as e:
+            raise InvalidConfig(
+                f'Invalid value for {section.name}.{opt.name} "{raw}": {e}')
+
+    return ret
+
+
+def plugin_module(pname: str) -> str:
+    """
+    Returns the plugin module name for a plugin section name, which can
+    also have an instance id (ie. "ping:core") and a shard number (ie.
+    "ping:core#1")
+    """
+    return re.split('[:#]', pname, maxsplit=1)[0]
+
 
 class TaxmanConfig(ConfigParser):
     def get_list(self, section, name):
         raw = self.get(section, name)
         return [s.strip() for s in raw.split()]
+
+    def get_plugins(self) -> List[str]:
+        """
+        Returns the names of the enabled plugin instances, after setting up
+        their sections.  An instance section, like "ping:core", gets any
+        options it doesn't set from the plugin's own section, like "ping".  A
+        section with "shards" set is split into that many instances, named
+        "<section>#<n>", which each check their share of the targets
+        """
+        ret = []
+        for pname in self.get_list('main', 'plugins_enabled'):
+            if not self.has_section(pname):
+                # This is caught as an invalid config by the manager
+                ret.append(pname)
+                continue
+
+            base = plugin_module(pname)
+            if base != pname and self.has_section(base):
+                # The options set in the instance section itself, without
+                # the ones from DEFAULT
+                own = self._sections[pname]
+                for k in self[base]:
+                    if k not in own:
+                        self[pname][k] = self.get(base, k, raw=True)
+
+            shards = self.getint(pname, 'shards', fallback=1)
+            if shards <= 1:
+                ret.append(pname)
+                continue
+
+            for i in range(shards):
+                name = f'{pname}#{i}'
+                self[name] = {
+                    k: self.get(pname, k, raw=True) for k in self[pname]
+                }
+                self[name]['shard'] = str(i)
+                ret.append(name)
+
+        return ret
@@ -0,0 +1,100 @@
+#
+# This is a local control interface for a running taxman.  It listens on a
+# unix socket for line based commands and replies to each with a single line
+# of JSON.  For example:
+#
+#   echo list | socat - UNIX-CONNECT:/run/taxman/control.sock
+#
+
+from libtaxman.errors import ControlError
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Thread
+
+import inspect
+import json
+import logging
+import os
+
+HELP = {
+    'list': 'list the plugins with their schedule and run stats',
+    'run <plugin>': 'run a plugin right now',
+    'set <plugin> <option> <value>': (
+        'change an option (ie. interval or max_workers) for a plugin.  Use '
+        '"main" as the plugin to change the size of the worker pool'
+    ),
+    'pause <plugin>': 'stop scheduling runs of a plugin',
+    'resume <plugin>': 'start scheduling runs of a paused plugin again',
+    'queue': 'show the depth of the submission queue',
+    'help': 'show this help',
+}
+
+
+class _Handler(StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            args = line.decode('utf-8', errors='replace').split()
+            if not args:
+                continue
+
+            try:
+                ret = {'ok': True, 'result': self._dispatch(*args)}
+            except ControlError as e:
+                ret = {'ok': False, 'error': str(e)}
+            except Exception as e:
+                logging.exception(f'Control command failed: {args}')
+                ret = {'ok': False, 'error': repr(e)}
+
+            self.wfile.write(json.dumps(ret).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+    def _dispatch(self, cmd, *args):
+        if cmd == 'help':
+            return HELP
+
+        meth = getattr(self.server.manager, f'ctl_{cmd}', None)
+        if meth is None:
+            raise ControlError(f'Unknown command "{cmd}", try "help"')
+
+        try:
+            inspect.signature(meth).bind(*args)
+        except TypeError:
+            raise ControlError(f'Invalid arguments for "{cmd}", try "help"')
+
+        return meth(*args)
+
+
+class ControlServer(Thread):
+    """
+    Serves the control socket in a background thread.  The commands are
+    mapped to the ctl_* methods of the manager
+    """
+    def __init__(self, path: str, manager):
+        super().__init__(name='control')
+        self.daemon = True
+        self.path = path
+        if os.path.exists(path):
+            # Left over from an unclean shutdown
+            os.unlink(path)
+
+        # This gives full control over the daemon, so lock it down.  The
+        # umask makes sure nobody else can connect before the chmod
+        old_umask = os.umask(0o177)
+        try:
+            self._server = ThreadingUnixStreamServer(path, _Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon_threads = True
+        self._server.manager = manager
+        os.chmod(path, 0o600)
+
+    def run(self):
+        logging.info(f'Listening for control commands on {self.path}')
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -1,3 +1,7 @@
 
 class InvalidConfig(Exception):
     pass
+
+
+class ControlError(Exception):
+    pass
@@ -0,0 +1,243 @@
+#
+# This loads the targets for plugins like ping and httpcheck from external
+# inventory files, for target lists that are too big to manage inline in the
+# config.  Files are only parsed when they change on disk
+#
+
+from libtaxman.config import Option, one_of
+from libtaxman.errors import InvalidConfig
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import csv
+import json
+import logging
+import os
+
+FORMATS = ('auto', 'lines', 'csv', 'jsonl')
+
+# Add these to the SCHEMA of a plugin that supports inventories
+INVENTORY_OPTS = (
+    Option('inventory', default=''),
+    Option('inventory_format', one_of(*FORMATS), 'auto'),
+    Option('inventory_field', default=''),
+)
+
+
+class Inventory:
+    """
+    A list of targets from a file or from a directory (ie. a conf.d) of
+    files.  The files can be plain lines, CSV or JSON lines, and the format
+    is picked from the extension unless it's set.  For CSV and JSON lines,
+    the target is in the given field (or column).  A CSV has to have a
+    header row naming its columns, so the field has to be set for it, while
+    JSON defaults to "target"
+    """
+    def __init__(self, path: str, fmt: str = 'auto', field: str = ''):
+        self.path = path
+        self.fmt = fmt
+        self.field = field
+        self.targets = []
+        self._sig = None
+
+    def refresh(self) -> bool:
+        """
+        Reload the targets if anything changed on disk since the last time.
+        This returns whether they were reloaded
+        """
+        try:
+            sig = self._get_sig()
+        except OSError as e:
+            if self._sig == 'missing':
+                return False
+
+            logging.warning(f'Failed to read the inventory {self.path}: {e}')
+            self._sig = 'missing'
+            self.targets = []
+            return True
+
+        if sig == self._sig:
+            return False
+
+        # This is set first so a broken file is only reported once, rather
+        # than on every run, until it's fixed
+        self._sig = sig
+        targets = []
+        try:
+            for path in self._get_files():
+                targets.extend(self._parse_file(path))
+        except Exception as e:
+            logging.error(
+                f'Failed to load the inventory {self.path}, keeping the '
+                f'previous targets: {e}'
+            )
+            return False
+
+
+        self.targets = targets
+        logging.debug(f'Loaded {len(targets)} targets from {self.path}')
+
+        return True
+
+    def _get_files(self) -> List[str]:
+        if not os.path.isdir(self.path):
+            return [self.path]
+
+        return [
+            os.path.join(self.path, name)
+            for name in sorted(os.listdir(self.path))
+            if not name.startswith('.') and
+                os.path.isfile(os.path.join(self.path, name))
+        ]
+
+    def _get_sig(self) -> tuple:
+        """
+        This changes whenever any of the files change
+        """
+        ret = []
+        for path in [self.path] + self._get_files():
+            st = os.stat(path)
+            ret.append((path, st.st_ino, st.st_size, st.st_mtime_ns))
+
+        return tuple(ret)
+
+    def _parse_file(self, path: str) -> List[str]:
+        fmt = self.fmt
+        if fmt == 'auto':
+            ext = os.path.splitext(path)[1].lower()
+            if ext == '.csv':
+                fmt = 'csv'
+            elif ext in ('.jsonl', '.json', '.ndjson'):
+                fmt = 'jsonl'
+            else:
+                fmt = 'lines'
+
+        with open(path, newline='') as fh:
+            if fmt == 'csv':
+                return list(self._parse_csv(path, fh))
+            elif fmt == 'jsonl':
+                return list(self._parse_jsonl(path, fh))
+
+            return [
+                line.strip() for line in fh
+                if line.strip() and not line.lstrip().startswith('#')
+            ]
+
+    def _parse_csv(self, path: str, fh) -> Iterator[str]:
+        if not self.field:
+            # Otherwise the header would be loaded as a target
+            raise ValueError(f'inventory_field has to be set to read {path}')
+
+        for row in csv.DictReader(fh):
+            if row.get(self.field):
+                yield row[self.field].strip()
+
+    def _parse_jsonl(self, path: str, fh) -> Iterator[str]:
+        field = self.field or 'target'
+        for i, line in enumerate(fh, 1):
+            if not line.strip():
+                continue
+
+            try:
+                obj = json.loads(line)
+                yield obj if isinstance(obj, str) else str(obj[field])
+            except Exception as e:
+                logging.warning(f'Skipping {path}:{i}, {e}')
+
+
+def get_inventory(opts) -> Optional[Inventory]:
+    """
+    Returns the inventory set up in a plugin's INVENTORY_OPTS, if any
+    """
+    if not opts.inventory:
+        return None
+
+    is_csv = opts.inventory_format == 'csv' or (
+        opts.inventory_format == 'auto' and
+        opts.inventory.lower().endswith('.csv')
+    )
+    if is_csv and not opts.inventory_field:
+        raise InvalidConfig(
+            f'inventory_field has to be set for the CSV inventory '
+            f'{opts.inventory}, to name the column with the targets'
+        )
+
+    return Inventory(
+        opts.inventory,
+        opts.inventory_format,
+        opts.inventory_field,
+    )
+
+
+class Targets:
+    """
+    The targets of a plugin, from the list in its config plus an optional
+    inventory.  Each target is parsed into whatever the plugin uses with
+    `parse` once, and kept for as long as it's in the list, so a change to
+    the inventory only costs the targets that were added
+    """
+    def __init__(
+            self,
+            inline: List[str],
+            inventory: Optional[Inventory],
+            parse: Callable[[str], Any],
+            owns: Callable[[str], bool]):
+        self._inline = inline
+        self._inventory = inventory
+        self._parse = parse
+        self._owns = owns
+        self._items = {}
+        if inventory is not None:
+            inventory.refresh()
+        self._load()
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+    def items(self) -> Dict[str, Any]:
+        return self._items
+
+    def refresh(self) -> bool:
+        """
+        Pick up any changes to the inventory.  This is cheap when nothing
+        has changed, so it can be called on every run
+        """
+        if self._inventory is None or not self._inventory.refresh():
+            return False
+
+        self._load()
+
+        return True
+
+    def _load(self):
+        raw = list(self._inline)
+        if self._inventory is not None:
+            raw.extend(self._inventory.targets)
+
+        items = {}
+        for key in raw:
+            if key in items or not self._owns(key):
+                continue
+
+            if key in self._items:
+                items[key] = self._items[key]
+                continue
+
+            try:
+                target = self._parse(key)
+            except Exception as e:
+                logging.warning(f'Skipping the invalid target "{key}": {e}')
+                continue
+
+            if target is not None:
+                items[key] = target
+
+        added = items.keys() - self._items.keys()
+        removed = self._items.keys() - items.keys()
+        if self._items and (added or removed):
+            logging.info(
+                f'Targets changed: {len(added)} added, {len(removed)} removed')
+
+        self._items = items
@@ -0,0 +1,259 @@
+#
+# This runs a collector in a dedicated worker process so CPU heavy plugins
+# don't compete for the GIL with everything else
+#
+
+from configparser import SectionProxy
+from importlib import import_module
+from libtaxman.collector import AsyncBaseCollector, BaseCollector
+from libtaxman.config import TaxmanConfig
+from multiprocessing.connection import Connection
+from queue import Queue
+from threading import Lock
+
+import asyncio
+import inspect
+import logging
+import multiprocessing as mp
+import signal
+import time
+
+# The isolation modes a plugin can be run in
+ISOLATION_MODES = ('none', 'process')
+
+
+class ProcessCollector(BaseCollector):
+    """
+    This stands in for a plugin that is run in a worker process.  The real
+    collector is built in the child and every run is requested over a pipe.
+    The results come back over the same pipe and are queued for submission
+    here, just like any other collector
+    """
+    # How long, in seconds, the worker gets to build the collector
+    STARTUP_TIMEOUT = 60
+
+    def __init__(self, res_q: Queue, config: SectionProxy, mod_name: str):
+        # The plugin class is only looked at for its SCHEMA, so a bad option
+        # is caught here, and on a reload or a set, like for any other
+        # plugin.  Plugins import their heavy dependencies lazily, so those
+        # are still only imported in the worker
+        self.SCHEMA = getattr(import_module(mod_name), config['name']).SCHEMA
+        super().__init__(res_q, config)
+        self._mod_name = mod_name
+        self._ctx = mp.get_context('spawn')
+        self._proc = None
+        self._conn = None
+        # The total CPU time used by the worker, as of its last reply
+        self._worker_cpu = 0.0
+        # Only one run at a time can use the pipe
+        self._pipe_lock = Lock()
+        self._start_worker()
+
+    def get_data_for_sub(self):
+        """
+        The worker streams back chunks as the plugin produces them, so this
+        is always a generator
+        """
+        with self._pipe_lock:
+            if self._stop.is_set():
+                # Don't bring back a worker that stop() got rid of
+                return
+
+            if not self._proc.is_alive():
+                logging.warning(f'Worker for {self.name} died, restarting it')
+                self._start_worker()
+
+            self._conn.send('run')
+            done = False
+            try:
+                while True:
+                    if not self._conn.poll(self.timeout):
+                        raise TimeoutError(
+                            f'Worker for {self.name} did not respond within '
+                            f'{self.timeout}s'
+                        )
+
+                    kind, payload, self._worker_cpu = self._conn.recv()
+                    if kind != 'chunk':
+                        break
+
+                    yield payload
+
+                done = True
+            finally:
+                if not done:
+                    # Either the run is hung or we stopped reading in the
+                    # middle of it.  Either way, the only way to get the
+                    # pipe back in sync is to kill the worker
+                    self._kill_worker()
+
+        if kind == 'error':
+            raise RuntimeError(payload)
+
+        if payload is not None:
+            yield payload
+
+    def reconfigure(self, config: SectionProxy) -> bool:
+        # The worker has its own copy of the config, so it has to be rebuilt
+        return False
+
+    def stop(self):
+        super().stop()
+        if not self._pipe_lock.acquire(blocking=False):
+            # A run has the pipe, and it could be a while before it lets go
+            # of it, so the worker is killed instead.  The run then fails on
+            # the closed pipe and cleans up after itself
+            if self._proc is not None and self._proc.is_alive():
+                logging.info(f'Killing the busy worker for {self.name}')
+                self._proc.kill()
+            return
+
+        try:
+            if self._proc is None or not self._proc.is_alive():
+                return
+
+            try:
+                self._conn.send('stop')
+            except Exception:
+                pass
+
+            self._proc.join(timeout=5)
+            if self._proc.is_alive():
+                self._kill_worker()
+        finally:
+            self._pipe_lock.release()
+
+    def _get_cpu_time(self) -> float:
+        return self._worker_cpu
+
+    def _start_worker(self):
+        """
+        Spawn the worker process and wait for it to build the collector
+        """
+        raw = {k: self.config.get(k, raw=True) for k in self.config}
+        # The node settings in main are needed to split up the targets
+        main = {}
+        if self.config.parser.has_section('main'):
+            main = {
+                k: self.config.parser.get('main', k, raw=True)
+                for k in self.config.parser['main']
+            }
+        self._conn, child_conn = self._ctx.Pipe()
+        self._proc = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                child_conn,
+                self._mod_name,
+                self.name,
+                raw,
+                main,
+                logging.getLogger().level,
+            ),
+            name=f'taxman-{self.name}',
+            daemon=True,
+        )
+        self._proc.start()
+        child_conn.close()
+
+        if not self._conn.poll(self.STARTUP_TIMEOUT):
+            self._kill_worker()
+            raise RuntimeError(
+                f'The worker for {self.name} did not start within '
+                f'{self.STARTUP_TIMEOUT}s'
+            )
+
+        try:
+            kind, payload, self._worker_cpu = self._conn.recv()
+        except EOFError:
+            kind, payload = ('error', 'worker exited during startup')
+
+        if kind == 'error':
+            self._proc.join(timeout=5)
+            raise RuntimeError(
+                f'Failed to start the worker for {self.name}: {payload}')
+
+        logging.debug(f'Started worker pid {self._proc.pid} for {self.name}')
+
+    def _kill_worker(self):
+        logging.warning(f'Killing the worker for {self.name}')
+        self._proc.kill()
+        self._proc.join(timeout=5)
+        self._conn.close()
+
+
+def _worker_main(
+        conn: Connection,
+        mod_name: str,
+        name: str,
+        raw: dict,
+        main: dict,
+        log_level: int):
+    """
+    This is the entry point for the worker process
+    """
+    # The parent handles the signals and tells us when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    logging.basicConfig(
+        format=(
+            f'%(asctime)s - %(levelname)s - [{name}] '
+            '%(filename)s:%(lineno)d %(funcName)s - %(message)s'
+        ),
+        level=log_level,
+    )
+
+    conf = TaxmanConfig(allow_no_value=True)
+    conf.read_dict({'main': main, name: raw})
+    try:
+        mod = import_module(mod_name)
+        klass = getattr(mod, conf[name]['name'])
+        # Results are sent straight back over the pipe so this queue is
+        # never used
+        inst = klass(Queue(), conf[name])
+    except Exception as e:
+        logging.exception(f'Failed to initialize {name} in the worker')
+        _reply(conn, 'error', repr(e))
+        return
+
+    loop = None
+    if isinstance(inst, AsyncBaseCollector):
+        loop = asyncio.new_event_loop()
+
+    _reply(conn, 'ready', None)
+    while True:
+        try:
+            cmd = conn.recv()
+        except EOFError:
+            break
+
+        if cmd == 'stop':
+            break
+
+        try:
+            data = inst.get_data_for_sub()
+            if inspect.isgenerator(data):
+                for item in data:
+                    _reply(conn, 'chunk', item)
+                data = None
+            elif inspect.isasyncgen(data):
+                while True:
+                    try:
+                        item = loop.run_until_complete(data.__anext__())
+                    except StopAsyncIteration:
+                        break
+                    _reply(conn, 'chunk', item)
+                data = None
+            elif loop is not None:
+                data = loop.run_until_complete(data)
+        except Exception as e:
+            _reply(conn, 'error', repr(e))
+        else:
+            _reply(conn, 'data', data)
+
+
+def _reply(conn: Connection, kind: str, payload):
+    """
+    Every reply carries the worker's CPU time so the parent can report what
+    each run cost
+    """
+    conn.send((kind, payload, time.process_time()))
@@ -1,139 +1,1020 @@
 
+from concurrent.futures import Future
 from configparser import SectionProxy
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import partial
 from importlib import import_module
-from libtaxman.collector import BaseCollector
-from libtaxman.config import TaxmanConfig
-from libtaxman.errors import InvalidConfig
+from libtaxman.collector import (
+    AsyncBaseCollector,
+    BaseCollector,
+    PushCollector,
+)
+from libtaxman.config import (
+    Option,
+    TaxmanConfig,
+    at_least,
+    get_opts,
+    plugin_module,
+)
+from libtaxman.errors import ControlError, InvalidConfig
+from libtaxman.partition import get_membership
+from libtaxman.pool import WorkerPool
+from libtaxman.scheduler import (
+    PhasePlanner,
+    Scheduler,
+    align_offset,
+    hash_offset,
+    is_backlogged,
+    to_exclusion_groups,
+)
 from libtaxman.submitter import Submitter
-from queue import Queue
+from queue import Empty, Queue
+from threading import Event, Thread
 from typing import Any, List
 
 import logging
+import sys
 import time
 
 
+@dataclass
+class LoadReport:
+    """
+    How long it took to import and initialize a plugin, along with the top
+    level packages that were imported for it.  Plugins are loaded in
+    parallel, so a package shared by 2 plugins is attributed to whichever
+    imports it first
+    """
+    import_time: float = 0.0
+    init_time: float = 0.0
+    packages: List[str] = field(default_factory=list)
+    modules: int = 0
+    error: str = None
+
+    def __str__(self):
+        return (
+            f'import {self.import_time * 1000:.1f}ms, '
+            f'init {self.init_time * 1000:.1f}ms, '
+            f'{self.modules} new modules from: '
+            f'{", ".join(self.packages) or "none"}'
+        )
+
+
 @dataclass
 class PluginInfo:
     name: str
     inst: Any
+    load: LoadReport = None
+    paused: bool = False
 
 
 class CollectorManager:
     PLUGIN_BASE = 'libtaxman.plugins'
+    # In "pool" mode, plugin runs are dispatched onto a shared, bounded pool
+    # of max_workers threads.  In "threads" mode, each plugin has its own
+    # thread
+    RUN_MODES = ('pool', 'threads')
+    # Changes to these in [main] only take effect on a restart
+    RESTART_OPTS = (
+        'run_mode',
+        'max_workers',
+        'max_queue',
+        'spool',
+        'spool_max_bytes',
+        'spool_max_age',
+    )
+    # Changes to these restart all the plugins on a reload, so the targets
+    # are split up across the new set of nodes
+    NODE_OPTS = ('node_id', 'node_count', 'members')
+    # Plugins in the same exclusion group, but on opposite sides of it, never
+    # run at the same time.  A due run waits up to exclusion_wait seconds (or
+    # the plugin's interval) for the other side to finish before it's skipped
+    EXCLUSION_OPTS = (
+        Option('exclusion_groups', to_exclusion_groups, {}),
+        Option('exclusion_wait', float, 30.0),
+    )
+    # The size of the collector pool (and of the init pool)
+    POOL_OPTS = (
+        Option('max_workers', at_least(1), 20),
+    )
+    # How often, in seconds, a waiting run checks whether it can start
+    EXCLUSION_POLL = 0.25
+    # Changes to these restart the submitter on a reload
+    SUBMIT_OPTS = (
+        'submission_url',
+        'submission_username',
+        'submission_password',
+        'batch_size',
+        'batch_bytes',
+        'batch_linger',
+        'submit_workers',
+        'spool_replay_rate',
+    )
 
-    def __init__(self, config: TaxmanConfig):
+    def __init__(
+            self,
+            config: TaxmanConfig,
+            once: bool = False,
+            submit: bool = True):
         self.config = config
+        # In once mode, nothing is scheduled and run_once() is used instead
+        # of run()
+        self._once = once
+        self._submit = submit
         self.plugins = {}
-        self._stop = False
+        self._stop = Event()
+        # This wakes up the main loop early, ie. for a reload or a stop
+        self._wake = Event()
+        self._new_config = None
+        self._sched = Scheduler()
+        self._planner = PhasePlanner()
+        # Cost phased plugins are re-placed once their cost is measured
+        self._costed = set()
+        # The plugins waiting on an exclusion group, with when they started
+        # waiting
+        self._excl = get_opts(self.config['main'], self.EXCLUSION_OPTS)
+        self._waiting = {}
+        self._epoch = time.monotonic()
         self._submitter = None
-        self._res_q = Queue()
-        self._init_submitter()
+        self._pool = None
+        self._loop = None
+        # Without a submitter, nothing drains the queue, so it can't be
+        # bounded
+        self._max_queue = 0
+        if submit:
+            self._max_queue = self.config['main'].getint('max_queue', 1000)
+        self._res_q = Queue(maxsize=self._max_queue)
+        self._workers = get_opts(
+            self.config['main'], self.POOL_OPTS).max_workers
+        # Plugins are built in parallel by the init pool.  Until they are
+        # up, they are in _pending as name -> (section, tries) and the
+        # results of each attempt come back to the main loop on _init_q
+        self._init_pool = WorkerPool(
+            max_workers=self._workers,
+            thread_name_prefix='init',
+        )
+        self._pending = {}
+        self._init_q = Queue()
+        # The paused plugins that are being rebuilt, so they come back paused
+        self._keep_paused = set()
+        self._retry_sched = Scheduler()
+        # Calls from the control socket to be run on the main loop
+        self._ctl_q = Queue()
+        self._control = None
+        self._init_run_pool()
+        if submit:
+            self._init_submitter()
         self._init_plugins()
+        if not once:
+            self._init_control()
 
     def run(self):
-        while not self._stop:
-            now = time.time()
-            for pi in self.plugins.values():
-                if pi.inst.next_sched <= now:
-                    pi.inst.run_now()
+        while not self._stop.is_set():
+            self._process_ctl()
+            self._process_inits()
+            now = time.monotonic()
+            for pname in self._sched.pop_due(now):
+                self._run_plugin(pname, now)
+
+            if self._new_config is not None:
+                self._apply_reload()
 
             sl_time = self._get_next_sleep()
             logging.debug(f'Sleeping for {sl_time:.02f}')
-            time.sleep(sl_time)
+            self._wake.wait(sl_time)
+            self._wake.clear()
 
         # If we get here, stop was set so we stop the plugin threads and
         # the submitter
         self._stop_all()
 
+    def run_once(self, init_timeout: float = 120) -> List[dict]:
+        """
+        Wait up to init_timeout seconds for all the plugins to initialize,
+        then run each of them exactly once, all in parallel, and return the
+        stats for every run.  This is for benchmarking a config, so failed
+        inits aren't retried
+        """
+        ret = {}
+        deadline = time.monotonic() + init_timeout
+        while self._pending:
+            try:
+                pname, sp, inst, retry, report = self._init_q.get(
+                    timeout=max(deadline - time.monotonic(), 0))
+            except Empty:
+                break
+
+            del self._pending[pname]
+            if inst is None:
+                ret[pname] = {
+                    'name': pname,
+                    'error': f'init failed: {report.error}',
+                }
+            else:
+                self.plugins[pname] = PluginInfo(pname, inst, report)
+
+        for pname in self._pending:
+            # These are still stuck in their init, on a daemon thread
+            ret[pname] = {
+                'name': pname,
+                'error': f'init did not finish within {init_timeout}s',
+            }
+        self._pending.clear()
+
+        threads = {}
+        for pname, pi in self.plugins.items():
+            if isinstance(pi.inst, PushCollector):
+                logging.info(f'Skipping {pname}, push plugins are not polled')
+                continue
+
+            pi.inst.start_run()
+            threads[pname] = Thread(
+                target=pi.inst.collect,
+                name=f'{pname}-once',
+                daemon=True,
+            )
+            threads[pname].start()
+
+        start = time.monotonic()
+        for pname, thread in threads.items():
+            inst = self.plugins[pname].inst
+            if inst.timeout is None:
+                thread.join()
+            else:
+                thread.join(max(start + inst.timeout - time.monotonic(), 0))
+
+            ret[pname] = self._get_run_stats(pname, thread.is_alive())
+
+        if self._submit:
+            # Let the submitter catch up before it's stopped
+            while not self._res_q.empty():
+                time.sleep(0.1)
+
+        # The submitter isn't a daemon thread, so any submission in progress
+        # is finished before we exit
+        self._stop_all()
+
+        return [ret[pname] for pname in sorted(ret)]
+
     def stop(self):
-        self._stop = True
+        self._stop.set()
+        self._wake.set()
+
+    def reload(self, config: TaxmanConfig):
+        """
+        Queue up a new config to be applied by the main loop.  This is safe
+        to call from a signal handler
+        """
+        self._new_config = config
+        self._wake.set()
+
+    def _apply_reload(self):
+        """
+        Diff the new config against the running one and only start, stop or
+        reconfigure the plugins whose sections have changed.  Everything
+        else keeps running, along with its connections and schedule
+        """
+        old, new = self.config, self._new_config
+        self._new_config = None
+        logging.info('Reloading the config')
+
+        for opt in self.RESTART_OPTS:
+            if old['main'].get(opt) != new['main'].get(opt):
+                logging.warning(
+                    f'Changing main.{opt} requires a restart, ignoring it')
+                new['main'][opt] = old['main'].get(opt)
+
+        self.config = new
+        try:
+            self._excl = get_opts(new['main'], self.EXCLUSION_OPTS)
+        except InvalidConfig as e:
+            logging.error(f'Keeping the old exclusion groups: {e}')
+
+        if any(
+                old['main'].get(opt) != new['main'].get(opt)
+                for opt in self.SUBMIT_OPTS):
+            logging.info('Submission settings changed, restarting submitter')
+            # The new submitter takes over the spool, with whatever is
+            # still in it
+            self._init_submitter(self._submitter.hand_off())
+
+        enabled = new.get_plugins()
+        for pname in list(self.plugins):
+            if pname not in enabled:
+                logging.info(f'Plugin {pname} was disabled, stopping it')
+                self._remove_plugin(pname)
+                self._keep_paused.discard(pname)
+
+        if any(
+                old['main'].get(opt) != new['main'].get(opt)
+                for opt in self.NODE_OPTS):
+            logging.info('The nodes changed, restarting all plugins')
+            for pname in list(self.plugins):
+                self._remove_plugin(pname)
+            for pname in list(self._pending):
+                del self._pending[pname]
+                self._retry_sched.remove(pname)
+
+        for pname in list(self._pending):
+            if pname not in enabled:
+                logging.info(f'Plugin {pname} was disabled, not retrying it')
+                del self._pending[pname]
+                self._retry_sched.remove(pname)
+                self._keep_paused.discard(pname)
+
+        for pname in enabled:
+            try:
+                self._reload_plugin(old, new, pname)
+            except Exception as e:
+                # A bad section shouldn't take everything else down
+                logging.error(f'Failed to reload plugin {pname}: {e}')
+
+    def _reload_plugin(self, old: TaxmanConfig, new: TaxmanConfig, pname: str):
+        if pname not in self.plugins:
+            if pname in self._pending and \
+                    not self._get_changed_opts(old, new, pname):
+                # Still being initialized with the same config
+                return
+
+            logging.info(f'Starting plugin {pname}')
+            self._add_plugin(pname)
+            return
+
+        changed = self._get_changed_opts(old, new, pname)
+        if not changed:
+            return
+
+        inst = self.plugins[pname].inst
+        try:
+            resched = changed <= BaseCollector.SCHED_OPTS and \
+                inst.reconfigure(new[pname])
+        except InvalidConfig as e:
+            # Nothing was changed, so it keeps running on its old config
+            logging.error(f'Not rescheduling plugin {pname}: {e}')
+            return
+
+        if resched:
+            logging.info(f'Rescheduling plugin {pname}: {changed}')
+            inst.next_sched = min(
+                inst.next_sched, time.monotonic() + inst.interval)
+            self._sched.schedule(pname, inst.next_sched)
+        else:
+            try:
+                if 'name' not in changed:
+                    get_opts(new[pname], inst.SCHEMA)
+            except InvalidConfig as e:
+                # Keep the old instance running rather than lose it
+                logging.error(f'Not restarting plugin {pname}: {e}')
+                return
+
+            logging.info(f'Restarting plugin {pname}: {changed}')
+            self._remove_plugin(pname)
+            self._add_plugin(pname)
+
+    def _get_changed_opts(
+            self,
+            old: TaxmanConfig,
+            new: TaxmanConfig,
+            pname: str) -> set:
+        """
+        Returns the names of the options that differ for a plugin section
+        between the 2 configs
+        """
+        if not new.has_section(pname):
+            # This will be caught as an invalid config when it's added
+            return {'name'}
+
+        old_opts = {k: old.get(pname, k, raw=True) for k in old[pname]}
+        new_opts = {k: new.get(pname, k, raw=True) for k in new[pname]}
+
+        return {
+            k for k in old_opts.keys() | new_opts.keys()
+            if old_opts.get(k) != new_opts.get(k)
+        }
+
+    def _run_plugin(self, pname: str, now: float):
+        """
+        Trigger a due plugin, if the missed run policy allows it, and put it
+        back in the schedule
+        """
+        pi = self.plugins.get(pname)
+        if pi is None:
+            return
+
+        if isinstance(pi.inst, PushCollector):
+            # This is only in the schedule to (re)start the watch
+            if not pi.paused and pi.inst.start_run(now):
+                self._dispatch(pi.inst)
+            return
+
+        if pname in self._waiting:
+            self._retry_excluded(pi, now)
+            return
+
+        run = pi.inst.sched_next(now)
+        if run and self._is_backlogged(pi.inst):
+            # This stretches the interval of the plugin until the submitter
+            # catches up, rather than piling up more data
+            run = False
+            pi.inst.deferred += 1
+            logging.info(
+                f'Skipping a run of {pname}, the submission queue has '
+                f'{self._res_q.qsize()} items'
+            )
+
+        if run and not pi.paused and self._is_excluded(pname):
+            logging.info(f'Holding {pname} until its exclusion group is clear')
+            self._waiting[pname] = now
+            self._sched.schedule(pname, now + self.EXCLUSION_POLL)
+            return
+
+        if run and not pi.paused and pi.inst.start_run(now):
+            self._dispatch(pi.inst)
+
+        if pi.inst.phase == 'cost' and pname not in self._costed and \
+                pi.inst.last_duration is not None:
+            # Now that we know what a run costs, find a better spot for it
+            # that isn't right on the heels of this run
+            self._costed.add(pname)
+            pi.inst.next_sched = self._get_first_sched(
+                pi.inst, now + pi.inst.interval / 2)
+
+        self._sched.schedule(pname, pi.inst.next_sched)
+
+    def _retry_excluded(self, pi: PluginInfo, now: float):
+        """
+        Start a run that was held by an exclusion group, if the group is
+        clear, or skip it if it's waited too long
+        """
+        waited = now - self._waiting[pi.name]
+        if not self._is_excluded(pi.name):
+            del self._waiting[pi.name]
+            if not pi.paused and pi.inst.start_run(now):
+                self._dispatch(pi.inst)
+        elif waited >= min(self._excl.exclusion_wait, pi.inst.interval):
+            del self._waiting[pi.name]
+            pi.inst.missed += 1
+            logging.warning(
+                f'Skipping a run of {pi.name}, its exclusion group was busy '
+                f'for {waited:.1f}s'
+            )
+        else:
+            self._sched.schedule(pi.name, now + self.EXCLUSION_POLL)
+            return
+
+        self._sched.schedule(pi.name, pi.inst.next_sched)
+
+    def _is_excluded(self, pname: str) -> bool:
+        """
+        Returns whether a plugin has to wait for the other side of one of its
+        exclusion groups.  That's the case while a plugin on the other side
+        is running or has been waiting longer, so neither side is starved
+        """
+        since = self._waiting.get(pname, time.monotonic())
+        for sides in self._excl.exclusion_groups.values():
+            for mine, other in (sides, sides[::-1]):
+                if not self._in_group(pname, mine):
+                    continue
+
+                for oname, opi in self.plugins.items():
+                    if not self._in_group(oname, other):
+                        continue
+
+                    if opi.inst.running or \
+                            self._waiting.get(oname, since) < since:
+                        return True
+
+        return False
+
+    def _in_group(self, pname: str, names: frozenset) -> bool:
+        """
+        A plugin is named in a group by its section, ie. "ping:core", or by
+        its plugin, ie. "ping", which covers all of its instances
+        """
+        return pname in names or pname.split('#')[0] in names or \
+            plugin_module(pname) in names
+
+    def _is_backlogged(self, inst: BaseCollector) -> bool:
+        return is_backlogged(
+            inst.priority, self._res_q.qsize(), self._max_queue)
+
+    def _dispatch(self, inst: BaseCollector):
+        """
+        Start a run of the plugin instance according to the run mode
+        """
+        if isinstance(inst, AsyncBaseCollector):
+            self._get_loop().submit(inst.collect_async())
+        elif self._pool is None or isinstance(inst, PushCollector):
+            inst.run_now()
+        else:
+            logging.debug(f'Dispatching a run of {inst.name} to the pool')
+            self._pool.submit(inst.collect)
 
     def _stop_all(self):
         """
         Stop all other threads
         """
+        if self._control is not None:
+            self._control.stop()
+
         for pi in self.plugins.values():
             pi.inst.stop()
 
-        self._submitter.stop()
+        self._init_pool.shutdown(cancel=True)
+        if self._pool is not None:
+            self._pool.shutdown(cancel=True)
+
+        if self._loop is not None:
+            self._loop.stop()
+
+        if self._submitter is not None:
+            self._submitter.stop()
+
+    def ctl_list(self):
+        return self._call_in_loop(self._list_plugins)
+
+    def ctl_run(self, pname: str):
+        return self._call_in_loop(self._run_now, pname)
+
+    def ctl_set(self, pname: str, opt: str, value: str):
+        return self._call_in_loop(self._set_opt, pname, opt, value)
+
+    def ctl_pause(self, pname: str):
+        return self._call_in_loop(self._set_paused, pname, True)
+
+    def ctl_resume(self, pname: str):
+        return self._call_in_loop(self._set_paused, pname, False)
+
+    def ctl_queue(self):
+        ret = {'depth': self._res_q.qsize(), 'max': self._max_queue}
+        if self._submitter is not None and self._submitter.spool is not None:
+            ret['spool_segments'] = len(self._submitter.spool)
+            ret['outage'] = self._submitter.outage.is_set()
+
+        return ret
+
+    def _call_in_loop(self, func, *args):
+        """
+        Run func on the main loop and wait for the result.  This keeps all
+        the changes to the plugins and the schedule on a single thread
+        """
+        fut = Future()
+        self._ctl_q.put((fut, func, args))
+        self._wake.set()
+
+        return fut.result(timeout=10)
+
+    def _process_ctl(self):
+        while True:
+            try:
+                fut, func, args = self._ctl_q.get_nowait()
+            except Empty:
+                break
+
+            try:
+                fut.set_result(func(*args))
+            except Exception as e:
+                fut.set_exception(e)
+
+    def _get_plugin(self, pname: str) -> PluginInfo:
+        if pname not in self.plugins:
+            raise ControlError(f'Unknown plugin: {pname}')
+
+        return self.plugins[pname]
+
+    def _list_plugins(self):
+        now = time.monotonic()
+        ret = []
+        for pname, pi in self.plugins.items():
+            inst = pi.inst
+            ret.append({
+                'name': pname,
+                'class': inst.__class__.__name__,
+                'interval': inst.interval,
+                'run_interval': inst.run_interval,
+                'next_run_in': round(inst.next_sched - now, 3),
+                'last_duration': inst.last_duration,
+                'last_cpu': inst.last_cpu,
+                'last_records': inst.last_records,
+                'last_error': inst.last_error,
+                'running': inst.running,
+                'paused': pi.paused,
+                'waiting': pname in self._waiting,
+                'missed': inst.missed,
+                'overruns': inst.overruns,
+                'priority': inst.priority,
+                'deferred': inst.deferred,
+                'dropped': inst.dropped,
+                'max_workers': inst.config.get('max_workers'),
+            })
+
+        for pname, (_, tries) in self._pending.items():
+            ret.append({'name': pname, 'initializing': True, 'tries': tries})
+
+        return ret
+
+    def _run_now(self, pname: str):
+        inst = self._get_plugin(pname).inst
+        if not inst.start_run():
+            return 'not started, see the overrun policy'
+
+        self._dispatch(inst)
+
+        return 'started'
+
+    def _set_opt(self, pname: str, opt: str, value: str):
+        if pname == 'main':
+            return self._set_main_opt(opt, value)
+
+        inst = self._get_plugin(pname).inst
+        # After a reload, the plugin can still have the section from the old
+        # config, but it's always rebuilt (and reloaded) from the current one
+        section = self.config[pname]
+        old = section.get(opt, raw=True)
+        section[opt] = value
+        if opt not in BaseCollector.SCHED_OPTS:
+            try:
+                get_opts(section, inst.SCHEMA)
+            except InvalidConfig as e:
+                self._revert_opt(section, opt, old)
+                raise ControlError(str(e))
+
+            # The plugin's options are converted when it's built, so it has
+            # to be rebuilt to pick this up
+            self._remove_plugin(pname)
+            self._add_plugin(pname)
+
+            return f'{pname}.{opt} = {value}, restarting {pname}'
+
+        try:
+            ok = inst.reconfigure(section)
+        except Exception as e:
+            ok = False
+            error = str(e)
+        else:
+            error = f'{pname} must be reloaded to change {opt}'
+
+        if not ok:
+            self._revert_opt(section, opt, old)
+            raise ControlError(error)
+
+        inst.next_sched = min(
+            inst.next_sched, time.monotonic() + inst.interval)
+        self._sched.schedule(pname, inst.next_sched)
+
+        return f'{pname}.{opt} = {value}'
+
+    def _revert_opt(self, section: SectionProxy, opt: str, old: str):
+        if old is None:
+            section.parser.remove_option(section.name, opt)
+        else:
+            section[opt] = old
+
+    def _set_main_opt(self, opt: str, value: str):
+        if opt != 'max_workers' or self._pool is None:
+            raise ControlError(
+                'Only max_workers can be changed in main, in pool mode')
+
+        try:
+            workers = at_least(1)(value)
+        except ValueError as e:
+            raise ControlError(f'Invalid max_workers "{value}": {e}')
+
+        # Runs in progress finish on the old pool
+        old_pool = self._pool
+        self._pool = WorkerPool(
+            max_workers=workers,
+            thread_name_prefix='collector',
+        )
+        old_pool.shutdown()
+        self._workers = workers
+        self.config['main']['max_workers'] = str(workers)
+
+        return f'main.max_workers = {workers}'
+
+    def _set_paused(self, pname: str, paused: bool):
+        pi = self._get_plugin(pname)
+        pi.paused = paused
+        if not paused and isinstance(pi.inst, PushCollector):
+            # Restart the watch if it ended while paused
+            self._sched.schedule(pname, time.monotonic())
+
+        return 'paused' if paused else 'resumed'
+
+    def _get_run_stats(self, pname: str, hung: bool) -> dict:
+        pi = self.plugins[pname]
+        inst = pi.inst
+        if hung:
+            return {
+                'name': pname,
+                'class': inst.__class__.__name__,
+                'error': f'did not finish within {inst.timeout}s',
+            }
+
+        return {
+            'name': pname,
+            'class': inst.__class__.__name__,
+            'load': pi.load.import_time + pi.load.init_time,
+            'wall': inst.last_duration,
+            'cpu': inst.last_cpu,
+            'records': inst.last_records,
+            'values': inst.last_values,
+            'error': inst.last_error,
+        }
+
+    def _get_first_sched(self, inst: BaseCollector, now: float) -> float:
+        """
+        Figure out when the plugin should first run according to its phase
+        mode, so that plugins don't all run in lockstep
+        """
+        if inst.phase == 'hash':
+            return now + hash_offset(inst.name, inst.interval)
+        elif inst.phase == 'align':
+            return now + align_offset(inst.interval)
+        elif inst.phase == 'cost':
+            cost = inst.last_duration or 1.0
+            offset = self._planner.place(inst.name, inst.interval, cost)
+            # The offset is relative to the manager's start
+            first = self._epoch + offset
+            if first < now:
+                first += ((now - first) // inst.interval + 1) * inst.interval
+
+            return first
+
+        return now
 
     def _get_next_sleep(self):
         """
         Calculate how long we need to sleep based on when a plugin is
         next scheduled to run
         """
-        now = time.time()
+        times = [
+            t for t in (self._sched.next_time(), self._retry_sched.next_time())
+            if t is not None
+        ]
+        if not times:
+            return 60
 
-        sl_time = 60
-        for pi in self.plugins.values():
-            tmp = pi.inst.next_sched - now
-            # Make sure we're not going backwards
-            tmp = 0.1 if tmp < 0.1 else tmp
+        next_time = min(times)
+
+        sl_time = next_time - time.monotonic()
+        # Make sure we're not going backwards
+        sl_time = 0.1 if sl_time < 0.1 else sl_time
+
+        return min(sl_time, 60)
+
+    def _init_run_pool(self):
+        mode = self.config['main'].get('run_mode', 'pool')
+        if mode not in self.RUN_MODES:
+            raise InvalidConfig(
+                f'Invalid run_mode "{mode}", must be one of: {self.RUN_MODES}')
+
+        if mode == 'pool':
+            # These are daemon threads, so a hung plugin run doesn't keep
+            # us from exiting
+            self._pool = WorkerPool(
+                max_workers=self._workers,
+                thread_name_prefix='collector',
+            )
 
-            if tmp < sl_time:
-                sl_time = tmp
+    def _get_loop(self):
+        """
+        The event loop for async collectors is only started (and asyncio only
+        imported) if there is an async plugin enabled
+        """
+        if self._loop is None:
+            from libtaxman.aio import EventLoopThread
+            self._loop = EventLoopThread()
+            self._loop.start()
+
+        return self._loop
 
-        return sl_time
+    def _init_control(self):
+        path = self.config['main'].get('control_socket')
+        if not path:
+            return
 
-    def _init_submitter(self):
-        self._submitter = Submitter(self._res_q, self.config)
+        from libtaxman.control import ControlServer
+        self._control = ControlServer(path, self)
+        self._control.start()
+
+    def _init_submitter(self, spool=None):
+        self._submitter = Submitter(self._res_q, self.config, spool)
         self._submitter.start()
 
     def _init_plugins(self):
         """
         Initialize and register all the enabled plugins
         """
+        # Catch a bad node setup here, rather than in every plugin
+        get_membership(self.config['main'])
         # Loop over the enabled plugins
-        for pname in self.config.get_list('main', 'plugins_enabled'):
-            # First, validate the config data
-            if not self.config.has_section(pname):
-                raise InvalidConfig(
-                    f'Enabled plugin "{pname}" does not have a '
-                    'corresponding config section'
-                )
-            if not self.config.has_option(pname, 'name'):
-                raise InvalidConfig(
-                    f'Enabled pluging "{pname}" does not have a config entry '
-                    'for the "name" of the plugin class'
-                )
+        for pname in self.config.get_plugins():
+            self._add_plugin(pname)
+
+    def _add_plugin(self, pname: str):
+        """
+        Validate a plugin's config and start initializing it in the
+        background.  It's registered by the main loop once it's up
+        """
+        # First, validate the config data
+        if not self.config.has_section(pname):
+            raise InvalidConfig(
+                f'Enabled plugin "{pname}" does not have a '
+                'corresponding config section'
+            )
+        if not self.config.has_option(pname, 'name'):
+            raise InvalidConfig(
+                f'Enabled pluging "{pname}" does not have a config entry '
+                'for the "name" of the plugin class'
+            )
+
+        # If we get here, we should have a valid config for the plugin
+        sp = self.config[pname]  # Returns a SectionProxy
+        self._pending[pname] = (sp, 0)
+        self._retry_sched.remove(pname)
+        self._init_pool.submit(self._build_plugin, pname, sp)
+
+    def _build_plugin(self, pname: str, sp: SectionProxy):
+        """
+        A single attempt at building a plugin instance.  This runs on the
+        init pool and reports back to the main loop
+        """
+        logging.debug(f'Initializing plugin: {pname}')
+        inst = None
+        retry = False
+        report = LoadReport()
+        try:
+            inst = self._get_plug_inst(pname, sp, report)
+        except InvalidConfig as e:
+            # There's no point in retrying these
+            logging.error(f'Invalid config for plugin {pname}: {e}')
+            report.error = str(e)
+        except Exception as e:
+            logging.exception(f'Failed to initialize plugin {pname}')
+            report.error = repr(e)
+            retry = True
+
+        self._init_q.put((pname, sp, inst, retry, report))
+        self._wake.set()
 
-            # If we get here, we should have a valid config for the plugin
-            sp = self.config[pname]  # Returns a SectionProxy
-            logging.debug(f'Initializing plugin: {pname}')
-            inst = self._get_plug_inst(pname, sp)
-            if not inst:
-                logging.error(f'Gave up on initializing {pname}')
+    def _process_inits(self):
+        """
+        Register the plugins that finished initializing and schedule retries
+        for the ones that failed, with a capped exponential backoff
+        """
+        while True:
+            try:
+                pname, sp, inst, retry, report = self._init_q.get_nowait()
+            except Empty:
+                break
+
+            pend = self._pending.get(pname)
+            if pend is None or pend[0] is not sp:
+                # This was disabled or changed by a reload in the meantime
+                if inst is not None:
+                    inst.stop()
                 continue
 
+            if inst is not None:
+                del self._pending[pname]
+                self._register_plugin(pname, inst, report)
+            elif retry:
+                tries = pend[1] + 1
+                self._pending[pname] = (sp, tries)
+                delay = min(
+                    2 ** tries,
+                    self.config['main'].getfloat('init_retry_max', 300),
+                )
+                logging.warning(
+                    f'Retrying the initialization of {pname} in {delay}s')
+                self._retry_sched.schedule(pname, time.monotonic() + delay)
+            else:
+                del self._pending[pname]
+
+        for pname in self._retry_sched.pop_due(time.monotonic()):
+            if pname in self._pending:
+                self._init_pool.submit(
+                    self._build_plugin, pname, self._pending[pname][0])
+
+    def _register_plugin(
+            self,
+            pname: str,
+            inst: BaseCollector,
+            report: LoadReport):
+        """
+        Start and schedule a freshly initialized plugin
+        """
+        if isinstance(inst, PushCollector):
+            # A push plugin always has its own thread for the watch
+            inst.on_exit = partial(self._push_exited, pname, inst)
             inst.start()
-            self.plugins[pname] = PluginInfo(
-                name=pname,
-                inst=inst,
-            )
-            logging.debug(f'Successfully initialized plugin: {pname}')
+        elif self._pool is None and \
+                not isinstance(inst, AsyncBaseCollector):
+            inst.start()
+
+        if not isinstance(inst, PushCollector):
+            inst.on_snap_back = partial(self._snapped_back, pname, inst)
+        self.plugins[pname] = PluginInfo(
+            name=pname,
+            inst=inst,
+            load=report,
+            paused=pname in self._keep_paused,
+        )
+        self._keep_paused.discard(pname)
+        inst.next_sched = self._get_first_sched(inst, time.monotonic())
+        self._sched.schedule(pname, inst.next_sched)
+        logging.info(f'Initialized plugin {pname}: {report}')
+
+    def _push_exited(self, pname: str, inst: PushCollector):
+        """
+        This is called from a push plugin's thread when its watch ends, to
+        schedule a restart from the main loop
+        """
+        self._ctl_q.put((Future(), self._restart_push, (pname, inst)))
+        self._wake.set()
+
+    def _snapped_back(self, pname: str, inst: BaseCollector, when: float):
+        """
+        This is called from a run when the plugin's adaptive interval snaps
+        back, to move its next run up from the main loop
+        """
+        self._ctl_q.put((Future(), self._move_up, (pname, inst, when)))
+        self._wake.set()
+
+    def _move_up(self, pname: str, inst: BaseCollector, when: float):
+        pi = self.plugins.get(pname)
+        if pi is None or pi.inst is not inst or pname in self._waiting:
+            # Replaced in the meantime, or already held for its next run
+            return
+
+        if when < inst.next_sched:
+            inst.next_sched = when
+            self._sched.schedule(pname, when)
+
+    def _restart_push(self, pname: str, inst: PushCollector):
+        pi = self.plugins.get(pname)
+        if pi is None or pi.inst is not inst:
+            # This was removed or replaced in the meantime
+            return
+
+        delay = min(
+            2 ** inst.failures,
+            self.config['main'].getfloat('init_retry_max', 300),
+        )
+        logging.warning(f'The watch for {pname} ended, restarting in {delay}s')
+        self._sched.schedule(pname, time.monotonic() + delay)
 
-    def _get_plug_inst(self, plug_name: str, sp: SectionProxy) -> BaseCollector:
+    def _remove_plugin(self, pname: str):
+        """
+        Stop a plugin and take it out of the schedule.  If it's paused, it
+        stays paused when it's added back
+        """
+        pi = self.plugins.pop(pname)
+        if pi.paused:
+            self._keep_paused.add(pname)
+        self._sched.remove(pname)
+        self._waiting.pop(pname, None)
+        self._planner.remove(pname)
+        self._costed.discard(pname)
+        pi.inst.stop()
+
+    def _get_plug_inst(
+            self,
+            plug_name: str,
+            sp: SectionProxy,
+            report: LoadReport) -> BaseCollector:
         """
         This is a convenience function to get the plugin class instance
-        by string name
-        """
-        ret = None
-        mod = import_module(f'{self.PLUGIN_BASE}.{plug_name}')
-        klass = getattr(mod, sp['name'])
-
-        max_retries = 5
-        tries = 0
-        while tries < max_retries:
-            # Try to get the plugin instance while catching any startup
-            # exceptions
-            tries += 1
-            try:
-                ret = klass(self._res_q, sp)
-            except Exception:
-                logging.exception(f'Failed to initialize plugin {plug_name}')
-                time.sleep(tries ** 2)
-            else:
-                break
+        by string name.  The import and init costs are recorded in the report
+        """
+        mod_name = f'{self.PLUGIN_BASE}.{plugin_module(plug_name)}'
+        isolation = sp.get('isolation', 'none')
+        if isolation != 'none':
+            from libtaxman.isolation import ISOLATION_MODES, ProcessCollector
+            if isolation not in ISOLATION_MODES:
+                raise InvalidConfig(
+                    f'Invalid isolation "{isolation}" for {plug_name}, must '
+                    f'be one of: {ISOLATION_MODES}'
+                )
 
-        return ret
+        before = set(sys.modules)
+        start = time.perf_counter()
+        if isolation == 'process':
+            # The plugin is only built in the worker process
+            klass = partial(ProcessCollector, mod_name=mod_name)
+        else:
+            mod = import_module(mod_name)
+            klass = getattr(mod, sp['name'])
+
+        report.import_time = time.perf_counter() - start
+        start = time.perf_counter()
+        try:
+            # Plugins import their heavy dependencies lazily, so this
+            # includes those
+            return klass(self._res_q, sp)
+        finally:
+            report.init_time = time.perf_counter() - start
+            new = set(sys.modules) - before
+            report.modules = len(new)
+            report.packages = sorted({m.split('.')[0] for m in new})
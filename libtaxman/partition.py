@@ -0,0 +1,62 @@
+#
+# Stable hashing helpers for splitting up a plugin's targets, across shards
+# and across taxman nodes.  These don't change across restarts or hosts,
+# unlike hash()
+#
+
+from configparser import SectionProxy
+from libtaxman.errors import InvalidConfig
+from typing import List, Optional, Tuple
+
+import hashlib
+import socket
+
+
+def stable_hash(key: str) -> int:
+    """
+    Returns a well distributed 64 bit hash of the key
+    """
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+
+    return int.from_bytes(digest, 'big')
+
+
+def shard_of(key: str, shards: int) -> int:
+    """
+    Returns which of the shards the key belongs to
+    """
+    return stable_hash(key) % shards
+
+
+def owner(key: str, members: List[str]) -> str:
+    """
+    Returns which of the members owns the key, using rendezvous hashing.
+    When a member is added or removed, only the keys that it gains or loses
+    change owners
+    """
+    return max(members, key=lambda m: stable_hash(f'{m}/{key}'))
+
+
+def get_membership(main: SectionProxy) -> Optional[Tuple[str, List[str]]]:
+    """
+    Returns the id of this node and the list of all the nodes from the main
+    section, or None if the targets aren't split across nodes.  The nodes
+    are either a static list of "members", with this node's id defaulting to
+    the hostname, or a "node_count" with this node's id as an index
+    """
+    members = main.get('members', '').split()
+    count = main.get('node_count')
+    if not members and not count:
+        return None
+
+    if members:
+        node_id = main.get('node_id') or socket.gethostname()
+    else:
+        members = [str(i) for i in range(int(count))]
+        node_id = main.get('node_id', '')
+
+    if node_id not in members:
+        raise InvalidConfig(
+            f'The node_id "{node_id}" must be one of the members: {members}')
+
+    return (node_id, members)
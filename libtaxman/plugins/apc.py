@@ -1,10 +1,17 @@
 
 from libtaxman.collector import BaseCollector
+from libtaxman.config import Option
 from gdata_subm import Gdata
 import logging
 import subprocess as sp
 
 class APCCollector(BaseCollector):
+    DEFAULT_TIMEOUT = 10
+    SCHEMA = (
+        Option('binary', default='/sbin/apcaccess'),
+        Option('apc_host', default=''),
+        Option('apc_port', int, None),
+    )
 
     def get_data_for_sub(self) -> Gdata:
         counters = None
@@ -21,20 +28,20 @@ class APCCollector(BaseCollector):
             dstypes=['gauge'] * len(counters),
             values=list(counters.values()),
             dsnames=list(counters.keys()),
-            interval=int(self.config['interval']),
+            interval=self.interval,
         )
 
     def _get_counters(self):
         """
         This will get all the current counters from the apcaccess binary
         """
-        cmd = [self.config['binary']]
-        if 'apc_host' in self.config and self.config['apc_host']:
+        cmd = [self.opts.binary]
+        if self.opts.apc_host:
             # If a specific host is set, use that here
-            hp = self.config['apc_host']
-            if 'apc_port' in self.config and self.config['apc_port']:
+            hp = self.opts.apc_host
+            if self.opts.apc_port:
                 # Append the port, if set
-                hp += f':{self.config["apc_port"]}'
+                hp += f':{self.opts.apc_port}'
 
             cmd.extend(['-h', hp])
 
@@ -44,6 +51,7 @@ class APCCollector(BaseCollector):
             stderr=sp.PIPE,
             encoding='utf-8',
             errors='replace',
+            timeout=self.timeout,
         )
 
         if proc.returncode != 0:
@@ -80,7 +88,7 @@ class APCCollector(BaseCollector):
                     ret['nom_power.watts'] = float(val.split()[0])
             except Exception as e:
                 logging.error(
-                    f'Error parsing output from {self.config["binary"]} '
+                    f'Error parsing output from {self.opts.binary} '
                     f'with line "{line}": {e}'
                 )
 
@@ -1,21 +1,33 @@
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
 from dataclasses import dataclass
 from datetime import datetime
 from gdata_subm import Gdata
+from functools import partial
 from io import StringIO
 from libtaxman.collector import BaseCollector
-from OpenSSL import crypto
+from libtaxman.config import Option, to_list
+from libtaxman.inventory import INVENTORY_OPTS, Targets, get_inventory
+from libtaxman.plugins.libfanout import (
+    TargetScheduler,
+    fan_out,
+    get_deadline,
+    to_overrides,
+)
 import logging
 import string
 import subprocess as sp
+import time
 
 
 @dataclass
 class Site:
     host: str
     port: int
-    
+    # The cert's expiration, as of the last time it was fetched
+    not_after: datetime = None
+    fetched: float = 0.0
+
     def cmd(self, openssl):
         return [
             openssl, 's_client',
@@ -28,15 +40,28 @@ class Site:
 
 
 class CertChk(BaseCollector):
+    SCHEMA = (
+        Option('openssl', default='/usr/bin/openssl'),
+        Option('services', to_list, ()),
+        Option('max_workers', int, 20),
+        Option('cache_time', float, 3600.0),
+        Option('overrides', to_overrides, ()),
+    ) + INVENTORY_OPTS
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._sites = []
-        self._init_sites()
+        self._sites = Targets(
+            self.opts.services,
+            get_inventory(self.opts),
+            self._to_site,
+            self.owns,
+        )
+        self.sched = TargetScheduler(self, self.opts.overrides)
 
     def get_data_for_sub(self) -> Gdata:
         counters = None
         try:
+            self._sites.refresh()
             counters = self._get_counters()
         except Exception:
             logging.exception("Failed to get counters for certchk")
@@ -44,49 +69,85 @@ class CertChk(BaseCollector):
         if not counters:
             return None
 
-        return Gdata(
-            plugin='cert',
-            dstypes=['gauge'] * len(counters),
-            values=list(counters.values()),
-            dsnames=list(counters.keys()),
-            interval=int(self.config['interval']),
-        )
+        # Sites with their own interval are submitted separately, with that
+        # interval
+        return [
+            Gdata(
+                plugin='cert',
+                dstypes=['gauge'] * len(remaining),
+                values=list(remaining.values()),
+                dsnames=list(remaining.keys()),
+                interval=interval,
+            )
+            for interval, remaining in counters.items()
+        ]
 
     def _get_counters(self):
         """
-        This will get the map of Site -> time in seconds to expiration
+        This will get the map of interval -> Site -> time in seconds to
+        expiration for the sites that are due.  The expiration of each cert
+        is only fetched once per cache_time and the time left is worked out
+        locally in between.  The sites that don't respond by the deadline
+        are left out
         """
-        ret = {}
-        workers = int(self.config['max_workers'])
-
-        with ThreadPoolExecutor(max_workers=workers) as exe:
-            fut_to_site = {
-                exe.submit(self._get_cert_exp, s): s
-                for s in self._sites
-            }
-
-            for fut in as_completed(fut_to_site):
-                site = fut_to_site[fut]
-                remaining = None
-
-                try:
-                    remaining = fut.result()
-                except Exception as e:
-                    logging.warning(
-                        f'Failed to get a response for {site}: {e}')
-                else:
-                    ret[str(site)] = remaining
+        ret = defaultdict(dict)
+        now = time.monotonic()
+        due = self.sched.due(self._sites.items(), now)
+        stale = [
+            (key, site) for key, site in due
+            if site.not_after is None or
+                now - site.fetched > self.opts.cache_time
+        ]
+
+        deadline = get_deadline(self)
+        done, late = fan_out(
+            partial(self._fetch, deadline=deadline),
+            stale,
+            self.opts.max_workers,
+            deadline,
+        )
+
+        for (_, site), fut in done:
+            try:
+                not_after = fut.result()
+            except Exception as e:
+                logging.warning(
+                    f'Failed to get a response for {site}: {e}')
+            else:
+                if not_after is not None:
+                    site.not_after = not_after
+                    site.fetched = now
+
+        for _, site in late:
+            logging.warning(f'Timed out after {deadline:.1f}s for {site}')
+
+        for key, site in due:
+            if site.not_after is not None and \
+                    now - site.fetched <= self.opts.cache_time:
+                interval = self.sched.opts_for(key).interval
+                remaining = site.not_after - datetime.now()
+                ret[interval][str(site)] = remaining.total_seconds()
 
         return ret
 
-    def _get_cert_exp(self, site: Site):
+    def _fetch(self, key_site: tuple, deadline: float) -> datetime:
+        key, site = key_site
+        timeout = self.sched.opts_for(key).timeout
+
+        return self._get_cert_exp(
+            site, min(timeout or deadline, deadline))
+
+    def _get_cert_exp(self, site: Site, timeout: float = None) -> datetime:
+        cmd = site.cmd(self.opts.openssl)
         proc = sp.run(
-            site.cmd(self.config['openssl']),
+            cmd,
             stdin=sp.DEVNULL,
             stdout=sp.PIPE,
             stderr=sp.PIPE,
             encoding='utf-8',
             errors='replace',
+            # Don't leave a hung openssl behind once we've given up on it
+            timeout=timeout,
         )
 
         if proc.returncode != 0:
@@ -95,9 +156,9 @@ class CertChk(BaseCollector):
 
             return None
 
-        return self._parse_cert_interval(proc.stdout)
+        return self._parse_not_after(proc.stdout)
 
-    def _parse_cert_interval(self, cert_txt):
+    def _parse_not_after(self, cert_txt) -> datetime:
         """
         We need to parse the cert after stripping the header and footer
         """
@@ -114,12 +175,10 @@ class CertChk(BaseCollector):
             if 'END ' in line:
                 break
 
-        na = self._get_not_after(tmp.getvalue())
-        interval = na - datetime.now()
-
-        return interval.total_seconds()
+        return self._get_not_after(tmp.getvalue())
 
     def _get_not_after(self, pem):
+        from OpenSSL import crypto
         c = crypto.load_certificate(crypto.FILETYPE_PEM, pem)
 
         na_tmp = c.get_notAfter().decode('utf-8')
@@ -127,8 +186,7 @@ class CertChk(BaseCollector):
         
         return datetime.strptime(na_str, '%Y%m%d%H%M%S')
 
-    def _init_sites(self):
-        for host_port in self.config['services'].split():
-            host, port = host_port.split(':')
-            self._sites.append(Site(host, int(port)))
-            
+    def _to_site(self, host_port: str) -> Site:
+        host, port = host_port.rsplit(':', 1)
+
+        return Site(host, int(port))
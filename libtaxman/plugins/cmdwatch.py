@@ -0,0 +1,86 @@
+
+from gdata_subm import Gdata
+from libtaxman.collector import PushCollector
+from libtaxman.config import Option
+from threading import Lock
+
+import logging
+import shlex
+import subprocess as sp
+
+
+class CmdWatchCollector(PushCollector):
+    """
+    This runs a long running command and submits a value for every line it
+    prints, as soon as it's printed.  Each line should be in the form of:
+
+        <dsname> <value>
+    """
+    SCHEMA = (
+        # This is split like a shell would, so arguments can be quoted
+        Option('command', shlex.split),
+        Option('instance', default=''),
+        Option('dstype', default='gauge'),
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._proc = None
+        self._proc_lock = Lock()
+
+    def watch(self):
+        with self._proc_lock:
+            if self.stopping:
+                return
+
+            self._proc = sp.Popen(
+                self.opts.command,
+                stdin=sp.DEVNULL,
+                stdout=sp.PIPE,
+                stderr=sp.DEVNULL,
+                encoding='utf-8',
+                errors='replace',
+            )
+
+        try:
+            for line in self._proc.stdout:
+                gd = self._parse_line(line)
+                if gd is not None and not self.emit(gd):
+                    break
+        finally:
+            self._kill()
+
+        logging.info(
+            f'{" ".join(self.opts.command)} exited with code '
+            f'{self._proc.returncode}'
+        )
+
+    def stop(self):
+        super().stop()
+        # This ends the watch
+        self._kill()
+
+    def _parse_line(self, line: str) -> Gdata:
+        try:
+            dsname, value = line.split()
+            value = float(value)
+        except ValueError:
+            logging.warning(f'Skipping an invalid line: {line.strip()}')
+            return None
+
+        return Gdata(
+            plugin='cmdwatch',
+            plugin_instance=self.opts.instance,
+            dstypes=[self.opts.dstype],
+            values=[value],
+            dsnames=[dsname],
+            interval=self.interval,
+        )
+
+    def _kill(self):
+        with self._proc_lock:
+            if self._proc is None or self._proc.poll() is not None:
+                return
+
+            self._proc.kill()
+            self._proc.wait()
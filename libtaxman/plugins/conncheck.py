@@ -1,10 +1,16 @@
 
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from libtaxman.collector import BaseCollector
+from libtaxman.config import Option, to_lines
+from libtaxman.inventory import INVENTORY_OPTS, Targets, get_inventory
+from libtaxman.plugins.libfanout import (
+    TargetScheduler,
+    fan_out,
+    get_deadline,
+    to_overrides,
+)
 from gdata_subm import Gdata
-from typing import List
 
 import logging
 import re
@@ -21,28 +27,42 @@ class ConnTest:
     exp_resp: re.Pattern
 
 class ConnTestCollector(BaseCollector):
+    SCHEMA = (
+        Option('checks', to_lines, ()),
+        Option('max_workers', int, 10),
+        Option('overrides', to_overrides, ()),
+    ) + INVENTORY_OPTS
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.tests = self._get_tests()
-        self.name_map = {self._get_name(t): t for t in self.tests}
+        self.tests = Targets(
+            self.opts.checks,
+            get_inventory(self.opts),
+            self._validate_and_get_check,
+            self.owns,
+        )
+        self.sched = TargetScheduler(self, self.opts.overrides)
 
     def get_data_for_sub(self) -> Gdata:
         health = None
         try:
+            self.tests.refresh()
             health = self._get_health()
         except Exception:
             logging.exception("Failed to get health in conntest")
             return None
 
+        # Checks with their own interval are submitted separately, with that
+        # interval
         return [
             Gdata(
                 plugin='conncheck',
-                dstypes=['gauge'] * len(health),
-                values=list(health.values()),
-                dsnames=list(health.keys()),
-                interval=int(self.config['interval']),
-            ),
+                dstypes=['gauge'] * len(results),
+                values=list(results.values()),
+                dsnames=list(results.keys()),
+                interval=interval,
+            )
+            for interval, results in health.items()
         ]
 
     def _get_name(self, test: ConnTest):
@@ -55,30 +75,45 @@ class ConnTestCollector(BaseCollector):
 
     def _get_health(self):
         """
-        This will check the health of all the sites in parallel
+        This will check the health of all the tests that are due in
+        parallel, and return the results by the interval of the tests.  The
+        tests that aren't done by the deadline are reported as failed
         """
-        ret = {}
-        workers = int(self.config['max_workers'])
-        with ThreadPoolExecutor(max_workers=workers) as exe:
-            fut_to_test = {
-                exe.submit(self._get_conn_result, t): t
-                for t in self.tests
-            }
-
-            for fut in as_completed(fut_to_test.keys()):
-                test = fut_to_test[fut]
-
-                res = 0
-                try:
-                    res = fut.result()
-                except Exception as e:
-                    logging.warning(
-                        f'Failed to get a response for {test}: {e}')
-
-                ret[self._get_name(test)] = res
+        ret = defaultdict(dict)
+        deadline = get_deadline(self)
+        done, late = fan_out(
+            self._check,
+            self.sched.due(self.tests.items()),
+            self.opts.max_workers,
+            deadline,
+        )
+
+        for (key, test), fut in done:
+            res = 0
+            try:
+                res = fut.result()
+            except Exception as e:
+                logging.warning(
+                    f'Failed to get a response for {test}: {e}')
+
+            interval = self.sched.opts_for(key).interval
+            ret[interval][self._get_name(test)] = res
+
+        for key, test in late:
+            logging.warning(f'Timed out after {deadline:.1f}s for {test}')
+            interval = self.sched.opts_for(key).interval
+            ret[interval][self._get_name(test)] = 0
 
         return ret
 
+    def _check(self, key_test: tuple) -> int:
+        key, test = key_test
+        timeout = self.sched.opts_for(key).timeout
+        if timeout is not None:
+            test = replace(test, timeout=timeout)
+
+        return self._get_conn_result(test)
+
     def _get_conn_result(self, test: ConnTest) -> int:
         """
         Returns a 1 on success, 0 otherwise
@@ -112,18 +147,6 @@ class ConnTestCollector(BaseCollector):
         sock.close()
         return 1
 
-    def _get_tests(self) -> List[ConnTest]:
-        ret = []
-        checks = [s.strip() for s in self.config['checks'].split('\n')
-            if s.strip()]
-
-        for check in checks:
-            chk = self._validate_and_get_check(check)
-            if chk is not None:
-                ret.append(chk)
-
-        return ret
-
     def _validate_and_get_check(self, check_str) -> ConnTest:
         c = check_str.split(';')
         if c[2].lower() not in ('tcp', 'udp'):
@@ -1,8 +1,15 @@
 
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from libtaxman.collector import BaseCollector
+from libtaxman.config import Option, to_list
+from libtaxman.inventory import INVENTORY_OPTS, Targets, get_inventory
+from libtaxman.plugins.libfanout import (
+    TargetScheduler,
+    fan_out,
+    get_deadline,
+    to_overrides,
+)
 from gdata_subm import Gdata
 from urllib.request import urlopen
 
@@ -24,87 +31,121 @@ class Result:
 
 
 class HttpHealthCollector(BaseCollector):
+    SCHEMA = (
+        Option('sites_https', to_list, ()),
+        Option('sites_http', to_list, ()),
+        Option('max_workers', int, 20),
+        Option('overrides', to_overrides, ()),
+    ) + INVENTORY_OPTS
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._site_map = {}
-        self._pop_site_map()
+        inline = [f'https://{s}' for s in self.opts.sites_https] + \
+            [f'http://{s}' for s in self.opts.sites_http]
+        self.targets = Targets(
+            inline,
+            get_inventory(self.opts),
+            self._to_site,
+            self.owns,
+        )
+        self.sched = TargetScheduler(self, self.opts.overrides)
 
     def get_data_for_sub(self) -> Gdata:
         health = None
         try:
+            self.targets.refresh()
             health = self._get_health()
         except Exception:
             logging.exception("Failed to get health in httpcheck")
             return None
 
-        health_dsnames = []
-        latency_dsnames = []
-        health_values = []
-        latency_values = []
-
-        for url, res in health.items():
-            site = self._site_map[url]
-            name = 'https.' if site.https else 'http.'
-            name += site.site.replace('.', '_')
-
-            health_dsnames.append(f'{name}.health')
-            latency_dsnames.append(f'{name}.latency')
-            health_values.append(res.result)
-            latency_values.append(res.latency)
-
-
-        return [
-            Gdata(
-                plugin='httpcheck',
-                dstypes=['gauge'] * len(health),
-                values=health_values,
-                dsnames=health_dsnames,
-                interval=int(self.config['interval']),
-            ),
-            Gdata(
-                plugin='httpcheck',
-                dstypes=['gauge'] * len(health),
-                values=latency_values,
-                dsnames=latency_dsnames,
-                interval=int(self.config['interval']),
-            ),
-
-        ]
+        # Sites with their own interval are submitted separately, with that
+        # interval
+        by_interval = defaultdict(list)
+        for key, site, res in health:
+            interval = self.sched.opts_for(key).interval
+            by_interval[interval].append((site, res))
+
+        ret = []
+        for interval, results in by_interval.items():
+            health_dsnames = []
+            latency_dsnames = []
+            health_values = []
+            latency_values = []
+
+            for site, res in results:
+                name = 'https.' if site.https else 'http.'
+                name += site.site.replace('.', '_')
+
+                health_dsnames.append(f'{name}.health')
+                latency_dsnames.append(f'{name}.latency')
+                health_values.append(res.result)
+                latency_values.append(res.latency)
+
+            ret.extend([
+                Gdata(
+                    plugin='httpcheck',
+                    dstypes=['gauge'] * len(results),
+                    values=health_values,
+                    dsnames=health_dsnames,
+                    interval=interval,
+                ),
+                Gdata(
+                    plugin='httpcheck',
+                    dstypes=['gauge'] * len(results),
+                    values=latency_values,
+                    dsnames=latency_dsnames,
+                    interval=interval,
+                ),
+            ])
+
+        return ret
 
     def _get_health(self):
         """
-        This will check the health of all the sites in parallel
+        This will check the health of all the sites that are due in
+        parallel.  The sites that don't respond by the deadline are reported
+        as unhealthy
         """
-        ret = {}
-        workers = int(self.config['max_workers'])
-        with ThreadPoolExecutor(max_workers=workers) as exe:
-            fut_to_url = {
-                exe.submit(self._get_rcode, k): k
-                for k in self._site_map
-            }
-
-            for fut in as_completed(fut_to_url.keys()):
-                url = fut_to_url[fut]
-                health = 0
-                latency = 0
-
-                try:
-                    code, latency = fut.result()
-                except Exception as e:
-                    logging.warning(
-                        f'Failed to get a response for {url}')
-                else:
-                    health = 1 if code == 200 else 0
-
-                ret[url] = Result(result=health, latency=latency)
+        ret = []
+        deadline = get_deadline(self)
+        done, late = fan_out(
+            self._check_site,
+            self.sched.due(self.targets.items()),
+            self.opts.max_workers,
+            deadline,
+        )
+
+        for (key, site), fut in done:
+            health = 0
+            latency = 0
+
+            try:
+                code, latency = fut.result()
+            except Exception as e:
+                logging.warning(
+                    f'Failed to get a response for {site.url}')
+            else:
+                health = 1 if code == 200 else 0
+
+            ret.append((key, site, Result(result=health, latency=latency)))
+
+        for key, site in late:
+            logging.warning(f'Timed out after {deadline:.1f}s for {site.url}')
+            ret.append((key, site, Result(result=0, latency=deadline)))
 
         return ret
 
-    def _get_rcode(self, url: str) -> int:
+    def _check_site(self, key_site: tuple) -> tuple:
+        key, site = key_site
+        timeout = self.sched.opts_for(key).timeout or 2
+
+        return self._get_rcode(site.url, timeout)
+
+    def _get_rcode(self, url: str, timeout: float = 2) -> int:
         start = time.time()
         try:
-            resp = urlopen(url, timeout=2)
+            resp = urlopen(url, timeout=timeout)
         except Exception as e:
             logging.warning(f'urlopen for url "{url}" failed: {e}')
             return (0, time.time() - start)
@@ -113,21 +154,16 @@ class HttpHealthCollector(BaseCollector):
 
         return (int(resp.getcode()), latency)
 
-    def _pop_site_map(self):
-        for site in self.config['sites_https'].split():
-            site = site.strip()
-            url = f'https://{site}'
-            self._site_map[url] = Site(
-                site=site,
-                https=True,
-                url=url,
-            )
-
-        for site in self.config['sites_http'].split():
-            site = site.strip()
-            url = f'http://{site}'
-            self._site_map[url] = Site(
-                site=site,
-                https=False,
-                url=url,
-            )
+    def _to_site(self, url: str) -> Site:
+        """
+        The sites from an inventory can be full urls or just the site, which
+        is checked over https
+        """
+        if '://' not in url:
+            url = f'https://{url}'
+
+        scheme, site = url.split('://', 1)
+        if scheme not in ('http', 'https'):
+            raise ValueError(f'Unsupported scheme: {scheme}')
+
+        return Site(site=site, https=(scheme == 'https'), url=url)
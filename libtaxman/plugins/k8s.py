@@ -3,7 +3,8 @@ import logging
 import string
 from gdata_subm import Gdata
 from libtaxman.collector import BaseCollector
-from kubernetes import client, config
+from libtaxman.config import Option
+from typing import Iterator
 
 
 CPU_CONV = {
@@ -14,37 +15,50 @@ CPU_CONV = {
 
 
 class K8sCollector(BaseCollector):
+    SCHEMA = (
+        Option('conf_file'),
+        Option('hostname'),
+        Option('page_size', int, 500),
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        config.load_config(config_file=self.config['conf_file'])
-        self.hostname = self.config['hostname']
-
-    def get_data_for_sub(self) -> Gdata:
-        tmp = self.get_session_counts()
-
-        if not tmp:
-            tmp['total'] = 0
-
+        # The kubernetes client is a heavy import, so it's only loaded when
+        # this plugin is actually used
+        from kubernetes import config
+        config.load_config(config_file=self.opts.conf_file)
+        self.hostname = self.opts.hostname
+
+    def get_data_for_sub(self) -> Iterator[Gdata]:
+        # On a big cluster, this is a lot of pods, so each pod is submitted
+        # as soon as it's parsed rather than all at once at the end
+        empty = True
+        for counts in self.get_session_counts():
+            empty = False
+            yield self._get_gdata(counts)
+
+        if empty:
+            yield self._get_gdata({'total': 0})
+
+    def _get_gdata(self, counts: dict) -> Gdata:
         return Gdata(
             plugin='k8s',
-            dstypes=['gauge'] * len(tmp),
-            values=list(tmp.values()),
-            dsnames=list(tmp.keys()),
+            dstypes=['gauge'] * len(counts),
+            values=list(counts.values()),
+            dsnames=list(counts.keys()),
             dtype_instance='pods',
             host=self.hostname,
-            interval=int(self.config['interval']),
+            interval=self.interval,
         )
 
-    def get_session_counts(self):
-        ret = {}
-
-        pods = client.CustomObjectsApi().list_cluster_custom_object(
-            'metrics.k8s.io',
-            'v1beta1',
-            'pods',
-        )
-
-        for entry in pods['items']:
+    def get_session_counts(self) -> Iterator[dict]:
+        """
+        This yields the cpu and memory usage of the containers of each pod.
+        The pods are fetched a page at a time so the whole list is never in
+        memory
+        """
+        for entry in self._get_pods():
+            ret = {}
             base_name = (
                 f'{entry["metadata"]["namespace"]}.'
                 f'{entry["metadata"]["name"]}'
@@ -71,6 +85,27 @@ class K8sCollector(BaseCollector):
                 ret[f'{base_name}.mem'] = \
                     float(cont["usage"]["memory"][:-2]) * 1024
 
-        logging.debug(f'Collected from k8s: {ret}')
+            logging.debug(f'Collected from k8s: {ret}')
+
+            yield ret
+
+    def _get_pods(self) -> Iterator[dict]:
+        from kubernetes import client
+        api = client.CustomObjectsApi()
+        token = None
+        while True:
+            kwargs = {'limit': self.opts.page_size}
+            if token:
+                kwargs['_continue'] = token
+
+            pods = api.list_cluster_custom_object(
+                'metrics.k8s.io',
+                'v1beta1',
+                'pods',
+                **kwargs,
+            )
+            yield from pods['items']
 
-        return ret
+            token = pods.get('metadata', {}).get('continue')
+            if not token:
+                break
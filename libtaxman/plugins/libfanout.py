@@ -0,0 +1,172 @@
+#
+# This is a library for plugins that check a number of targets in parallel
+# and need to report on the ones that are done without waiting on the slow
+# ones
+#
+
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    TimeoutError,
+    as_completed,
+)
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import logging
+import time
+
+
+@dataclass(frozen=True)
+class TargetOpts:
+    """
+    The interval and timeout, in seconds, for checking a single target.  A
+    timeout of None leaves it to the plugin
+    """
+    interval: float
+    timeout: Optional[float] = None
+
+
+def to_overrides(raw: str) -> List[Tuple[str, dict]]:
+    """
+    A config converter for per-target overrides, 1 per line, like:
+
+        <target glob> interval=<secs> timeout=<secs>
+    """
+    ret = []
+    for line in raw.split('\n'):
+        parts = line.split()
+        if not parts:
+            continue
+
+        opts = {}
+        for part in parts[1:]:
+            key, _, value = part.partition('=')
+            if key not in ('interval', 'timeout'):
+                raise ValueError(f'Unknown override "{part}"')
+            opts[key] = float(value)
+
+        ret.append((parts[0], opts))
+
+    return ret
+
+
+def get_deadline(collector) -> float:
+    """
+    Returns the deadline, in seconds, for a collector to gather the results
+    for its targets.  Unless it's configured, this is a bit short of the
+    collector's timeout or interval, whichever comes first
+    """
+    deadline = collector.config.get('deadline')
+    if deadline:
+        return float(deadline)
+
+    limit = collector.interval
+    if collector.timeout is not None:
+        limit = min(limit, collector.timeout)
+
+    return limit * 0.9
+
+
+def fan_out(
+        func: Callable,
+        targets: Iterable[Any],
+        max_workers: int,
+        deadline: float) -> Tuple[List[Tuple[Any, Future]], List[Any]]:
+    """
+    Run func for each of the targets in a pool of threads.  This returns a
+    list of (target, future) for everything that finished by the deadline,
+    along with the list of the targets that didn't.  The late ones are left
+    to finish in the background and their results are discarded
+    """
+    exe = ThreadPoolExecutor(max_workers=max_workers)
+    fut_to_target = {exe.submit(func, t): t for t in targets}
+    done = []
+    try:
+        for fut in as_completed(fut_to_target, timeout=deadline):
+            done.append((fut_to_target[fut], fut))
+    except TimeoutError:
+        pass
+    finally:
+        exe.shutdown(wait=False, cancel_futures=True)
+
+    finished = {fut for _, fut in done}
+    late = [t for fut, t in fut_to_target.items() if fut not in finished]
+
+    return (done, late)
+
+
+class TargetScheduler:
+    """
+    This lets the targets of a fan-out plugin be checked on their own
+    intervals.  The plugin's interval is how often it checks for due
+    targets, so it's also the shortest a target's interval can be.  The
+    first override whose glob matches a target applies to it, and targets
+    without one are checked on every run
+    """
+    def __init__(self, collector, overrides: List[Tuple[str, dict]]):
+        self._collector = collector
+        self._overrides = overrides
+        self._opts = {}
+        self._next = {}
+        self._tick = collector.interval
+
+    def opts_for(self, key: str) -> TargetOpts:
+        if key not in self._opts:
+            self._opts[key] = self._get_opts(key)
+
+        return self._opts[key]
+
+    def due(self, targets: Dict[str, Any], now: float = None) -> List[tuple]:
+        """
+        Returns the (key, target) pairs from the targets that are due and
+        schedules their next check
+        """
+        now = time.monotonic() if now is None else now
+        if self._collector.interval != self._tick:
+            # The defaults are based on the plugin's interval
+            self._tick = self._collector.interval
+            self._opts.clear()
+
+        # The plugin's own runs jitter a bit, so anything due before its
+        # next run is checked now
+        slack = self._collector.interval / 2
+        for key in self._next.keys() - targets.keys():
+            del self._next[key]
+            self._opts.pop(key, None)
+
+        ret = []
+        for key, target in targets.items():
+            nxt = self._next.get(key, now)
+            if nxt > now + slack:
+                continue
+
+            interval = self.opts_for(key).interval
+            nxt += interval
+            # Don't try to make up for checks missed during a stall
+            self._next[key] = nxt if nxt > now else now + interval
+            ret.append((key, target))
+
+        return ret
+
+    def _get_opts(self, key: str) -> TargetOpts:
+        interval = self._collector.interval
+        for glob, opts in self._overrides:
+            if not fnmatchcase(key, glob):
+                continue
+
+            ret = TargetOpts(
+                opts.get('interval', interval),
+                opts.get('timeout'),
+            )
+            if ret.interval < interval:
+                logging.warning(
+                    f'The interval for {key} is shorter than the interval '
+                    f'for {self._collector.name}, using {interval}s'
+                )
+                ret = TargetOpts(interval, ret.timeout)
+
+            return ret
+
+        return TargetOpts(interval)
@@ -2,7 +2,7 @@
 from gdata_subm import Gdata
 from libtaxman.plugins.libprocstats import get_stats_for_file
 from libtaxman.collector import BaseCollector
-from typing import List
+from typing import Iterator
 
 import logging
 
@@ -10,26 +10,23 @@ import logging
 class NetstatCollector(BaseCollector):
     STAT_FILE = '/proc/net/netstat'
 
-    def get_data_for_sub(self) -> List[Gdata]:
+    def get_data_for_sub(self) -> Iterator[Gdata]:
         try:
             counters = self._get_counters()
         except Exception:
             logging.exception('Failed to get netstat counters')
-            return None
-
-        ret = []
+            return
 
+        # These are submitted as they are built
         for prefix, data in counters.items():
-            ret.append(Gdata(
+            yield Gdata(
                 plugin='netstat',
                 dtype=prefix,
                 dstypes=['counter'] * len(data),
                 values=list(data.values()),
                 dsnames=list(data.keys()),
-                interval=int(self.config['interval']),
-            ))
-
-        return ret
+                interval=self.interval,
+            )
 
     def _get_counters(self):
         """
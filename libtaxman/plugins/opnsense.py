@@ -6,19 +6,29 @@
 
 from gdata_subm import Gdata
 from libtaxman.collector import BaseCollector
-from pyopn import OPNClient
+from libtaxman.config import Option, to_bool, to_list
 from typing import List
 import logging
 
 
 class OPNSenseCollector(BaseCollector):
+    SCHEMA = (
+        Option('base_url'),
+        Option('key'),
+        Option('secret'),
+        Option('ssl_verify', to_bool, True),
+        Option('interfaces', to_list),
+        Option('gdata_host', default=None),
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        from pyopn import OPNClient
         self._oapi = OPNClient(
-            api_key=self.config['key'],
-            api_secret=self.config['secret'],
-            base_url=self.config['base_url'],
-            ssl_verify=self.config.getboolean('ssl_verify'),
+            api_key=self.opts.key,
+            api_secret=self.opts.secret,
+            base_url=self.opts.base_url,
+            ssl_verify=self.opts.ssl_verify,
         )
 
     def get_data_for_sub(self) -> List[Gdata]:
@@ -27,7 +37,7 @@ class OPNSenseCollector(BaseCollector):
             stats = self._get_stats()
         except Exception as e:
             logging.error(
-                f'Failed to get stats from {self.config["base_url"]}: {e}')
+                f'Failed to get stats from {self.opts.base_url}: {e}')
             return ret
 
         ret.extend(self._get_int_gdata(stats))
@@ -60,8 +70,8 @@ class OPNSenseCollector(BaseCollector):
                 dsnames=dsnames,
                 dstypes=dstypes,
                 values=values,
-                interval=float(self.config['interval']),
-                host=self.config['gdata_host'],
+                interval=self.interval,
+                host=self.opts.gdata_host,
             ))
 
         return ret
@@ -71,8 +81,7 @@ class OPNSenseCollector(BaseCollector):
         Get stats from the server
         """
         ret = {'interface': {}}
-
-        ifaces = [i.strip() for i in self.config['interfaces'].split()]
+        ifaces = self.opts.interfaces
 
         # First, get the interface stats
         stats = self._oapi.diagnostics.interface.get_interface_statistics()
@@ -5,18 +5,27 @@
 
 from gdata_subm import Gdata
 from libtaxman.collector import BaseCollector
-from PfsenseFauxapi.PfsenseFauxapi import PfsenseFauxapi
+from libtaxman.config import Option, to_list
 from typing import List
 import logging
 
 
 class PfsenseCollector(BaseCollector):
+    SCHEMA = (
+        Option('api_host'),
+        Option('key'),
+        Option('secret'),
+        Option('interfaces', to_list),
+        Option('gdata_host', default=None),
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        from PfsenseFauxapi.PfsenseFauxapi import PfsenseFauxapi
         self._fapi = PfsenseFauxapi(
-            self.config['api_host'],
-            self.config['key'],
-            self.config['secret'],
+            self.opts.api_host,
+            self.opts.key,
+            self.opts.secret,
         )
 
     def get_data_for_sub(self) -> List[Gdata]:
@@ -25,7 +34,7 @@ class PfsenseCollector(BaseCollector):
             stats = self._get_stats()
         except Exception as e:
             logging.error(
-                f'Failed to get stats from {self.config["api_host"]}: {e}')
+                f'Failed to get stats from {self.opts.api_host}: {e}')
             return ret
         
         ret.extend(self._get_int_gdata(stats))
@@ -59,8 +68,8 @@ class PfsenseCollector(BaseCollector):
                 dsnames=dsnames,
                 dstypes=dstypes,
                 values=values,
-                interval=float(self.config['interval']),
-                host=self.config['gdata_host'],
+                interval=self.interval,
+                host=self.opts.gdata_host,
             ))
         
         return ret
@@ -72,8 +81,8 @@ class PfsenseCollector(BaseCollector):
             dsnames=list(stats['system'].keys()),
             dstypes=['gauge'] * len(stats['system']),
             values=list(stats['system'].values()),
-            interval=float(self.config['interval']),
-            host=self.config['gdata_host'],
+            interval=self.interval,
+            host=self.opts.gdata_host,
         )
 
     def _get_stats(self):
@@ -82,8 +91,7 @@ class PfsenseCollector(BaseCollector):
         """
         ret = {'interface': {}}
         # First, get the interface stats
-        for iface in self.config['interfaces'].split():
-            iface = iface.strip()
+        for iface in self.opts.interfaces:
             stats = self._fapi.interface_stats(iface)
             if stats and stats['message'] == 'ok':
                 ret['interface'][iface] = stats['data']['stats']
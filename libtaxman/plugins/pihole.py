@@ -1,5 +1,6 @@
 
 from libtaxman.collector import BaseCollector
+from libtaxman.config import Option, split_on
 from gdata_subm import Gdata
 from urllib.request import urlopen
 import json
@@ -7,6 +8,9 @@ import logging
 import os
 
 class PiholeCollector(BaseCollector):
+    SCHEMA = (
+        Option('hosts', split_on(','), ()),
+    )
 
     def get_data_for_sub(self) -> Gdata:
         counters = None
@@ -30,7 +34,7 @@ class PiholeCollector(BaseCollector):
                 dstypes=['counter'] * len(cdata) + ['gauge'],
                 values=list(cdata.values()) + [data['enabled']],
                 dsnames=list(cdata.keys()) + ['enabled'],
-                interval=int(self.config['interval']),
+                interval=self.interval,
             ))
 
         return ret
@@ -39,10 +43,9 @@ class PiholeCollector(BaseCollector):
         """
         This will get all the current counters from the apcaccess binary
         """
-        hosts = [h.strip() for h in self.config['hosts'].split(',')]
         ret = {}
 
-        for host in hosts:
+        for host in self.opts.hosts:
             url = self._gen_url(host)
             with urlopen(url) as resp:
                 data = json.loads(resp.read())
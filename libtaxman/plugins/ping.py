@@ -1,15 +1,20 @@
 
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from libtaxman.collector import BaseCollector
+from libtaxman.collector import AsyncBaseCollector
+from libtaxman.config import Option, to_lines
+from libtaxman.inventory import INVENTORY_OPTS, Targets, get_inventory
+from libtaxman.plugins.libfanout import (
+    TargetScheduler,
+    get_deadline,
+    to_overrides,
+)
 from gdata_subm import Gdata
 from typing import List
 
+import asyncio
 import logging
-import multiprocessing as mp
 import re
-import subprocess as sp
 
 
 LOSS_REG = re.compile(r'([\d\.]+)% packet loss')
@@ -22,12 +27,31 @@ class PingResult:
     loss: float
 
 
-class PingCollector(BaseCollector):
-
-    def get_data_for_sub(self) -> Gdata:
+class PingCollector(AsyncBaseCollector):
+    SCHEMA = (
+        Option('binary'),
+        Option('max_workers', int, 10),
+        Option('hosts', to_lines, ()),
+        Option('overrides', to_overrides, ()),
+    ) + INVENTORY_OPTS
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hosts = Targets(
+            self.opts.hosts,
+            get_inventory(self.opts),
+            str,
+            self.owns,
+        )
+        self.sched = TargetScheduler(self, self.opts.overrides)
+
+    async def get_data_for_sub(self) -> Gdata:
         health = None
         try:
-            health = self._get_health()
+            # A changed inventory is parsed off of the event loop
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.hosts.refresh)
+            health = await self._get_health()
         except Exception:
             logging.exception("Failed to get health in httpcheck")
             return None
@@ -35,79 +59,129 @@ class PingCollector(BaseCollector):
         ret = []
 
         for host, results in health.items():
+            interval = self.sched.opts_for(host).interval
             lats = [r.latency for r in results]
-            ret.append(
-                Gdata(
-                    plugin='ping',
-                    dtype=host,
-                    dstypes=['gauge'] * len(lats),
-                    values=lats,
-                    dsnames=['lat'] * len(lats),
-                    interval=int(self.config['interval']),
+            if lats:
+                ret.append(
+                    Gdata(
+                        plugin='ping',
+                        dtype=host,
+                        dstypes=['gauge'] * len(lats),
+                        values=lats,
+                        dsnames=['lat'] * len(lats),
+                        interval=interval,
+                    )
                 )
-            )
+            # Without any replies, there's nothing to get the loss from
+            loss = results[0].loss if results else 100.0
             ret.append(
                 Gdata(
                     plugin='ping',
                     dtype=host,
                     dstypes=['gauge'],
-                    values=[results[0].loss],
+                    values=[loss],
                     dsnames=['loss'],
-                    interval=int(self.config['interval']),
+                    interval=interval,
                 )
             )
 
         return ret
 
-    def _get_health(self):
+    async def _get_health(self):
         """
-        This will check the health of all the sites in parallel
+        This will check the health of all the hosts that are due in
+        parallel.  The hosts that aren't done by the deadline are reported
+        with 100% loss, unless they had to wait for a worker and didn't get
+        their full time, since there's no telling if those are up
         """
         ret = {}
-        workers = int(self.config['max_workers'])
-        hosts = [s.strip() for s in self.config['hosts'].split('\n')
-            if s.strip()]
-        '''
-        args = [(h, int(self.config['interval']), self.config['binary'])
-            for h in hosts]
-        with mp.Pool(len(hosts)) as pool:
-            results = pool.starmap(_get_ping_results, args)
-            return dict(zip(hosts, results))
-        '''
-        with ThreadPoolExecutor(max_workers=workers) as exe:
-            fut_to_host = {
-                exe.submit(_get_ping_results,
-                    h, self.config['interval'], self.config['binary']): h
-                for h in hosts
-            }
-
-            for fut in as_completed(fut_to_host.keys()):
-                host = fut_to_host[fut]
-
-                try:
-                    results = fut.result()
-                except Exception as e:
-                    logging.exception(
-                        f'Failed to get a response for {host}')
-                    continue
-
-                ret[host] = results
+        # This bounds the number of ping processes running at once
+        sem = asyncio.Semaphore(self.opts.max_workers)
+        loop = asyncio.get_running_loop()
+        # When each host's ping would wrap up, once it got a worker
+        finish_by = {}
+
+        # The pings themselves wrap up a second ahead of the deadline, so
+        # only the hosts that are truly stuck (ie. in DNS) are late
+        deadline = get_deadline(self)
+        end = loop.time() + deadline
+
+        async def _ping(host):
+            timeout = self.sched.opts_for(host).timeout or deadline
+            secs = max(int(min(timeout, deadline)) - 1, 1)
+            async with sem:
+                finish_by[host] = loop.time() + secs
+                return await _get_ping_results(
+                    host, secs, self.opts.binary)
+
+        tasks = {
+            asyncio.ensure_future(_ping(h)): h
+            for h, _ in self.sched.due(self.hosts.items())
+        }
+        if not tasks:
+            return ret
+
+        _, late = await asyncio.wait(tasks, timeout=deadline)
+        for task in late:
+            # This kills the ping process
+            task.cancel()
+        await asyncio.gather(*late, return_exceptions=True)
+
+        cut_short = {
+            host for task, host in tasks.items()
+            if task in late and finish_by.get(host, end + 1) > end
+        }
+        if cut_short:
+            logging.warning(
+                f'Skipping {len(cut_short)} hosts that waited too long for a '
+                f'worker, max_workers ({self.opts.max_workers}) is too low for '
+                f'the {len(tasks)} due hosts'
+            )
+
+        for task, host in tasks.items():
+            if host in cut_short:
+                continue
+            elif task in late:
+                logging.warning(f'Timed out after {deadline:.1f}s for {host}')
+                ret[host] = []
+            elif task.exception() is not None:
+                logging.error(
+                    f'Failed to get a response for {host}: '
+                    f'{task.exception()}'
+                )
+            else:
+                ret[host] = task.result()
 
         return ret
 
 
-def _get_ping_results(host, interval, binary) -> List[PingResult]:
-    ret = []
-    deadline = '{}'.format(int(interval) - 1)
+async def _get_ping_results(host, secs, binary) -> List[PingResult]:
+    deadline = '{}'.format(int(secs))
     cmd = [
         binary,
         '-c', deadline,
         '-w', deadline,
         host,
     ]
-    res = sp.run(cmd, stdout=sp.PIPE, stderr=sp.DEVNULL, encoding='utf-8')
-    lines = res.stdout.strip().split('\n')
-
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        stdout, _ = await proc.communicate()
+    except asyncio.CancelledError:
+        # Don't leave the ping process behind if we are cancelled
+        proc.kill()
+        await proc.wait()
+        raise
+
+    return _parse_ping_output(stdout.decode('utf-8', errors='replace'))
+
+
+def _parse_ping_output(output: str) -> List[PingResult]:
+    ret = []
+    lines = output.strip().split('\n')
 
     loss_perc = 0.0
     for line in lines[-3:]:
@@ -2,9 +2,9 @@
 from collections import defaultdict
 from gdata_subm import Gdata
 from libtaxman.collector import BaseCollector
+from libtaxman.config import Option
 from urllib.parse import urlencode
 from urllib.request import urlopen
-from plexapi.server import PlexServer
 
 import json
 import logging
@@ -12,11 +12,17 @@ import os
 
 
 class PlexCollector(BaseCollector):
+    SCHEMA = (
+        Option('base_url'),
+        Option('api_token'),
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        from plexapi.server import PlexServer
         self._server = PlexServer(
-            self.config['base_url'],
-            self.config['api_token'],
+            self.opts.base_url,
+            self.opts.api_token,
         )
 
     def get_data_for_sub(self) -> Gdata:
@@ -31,7 +37,7 @@ class PlexCollector(BaseCollector):
             values=list(tmp.values()),
             dsnames=list(tmp.keys()),
             dtype_instance='sessions',
-            interval=int(self.config['interval']),
+            interval=self.interval,
         )
 
     def get_session_counts(self):
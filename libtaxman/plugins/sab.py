@@ -1,6 +1,7 @@
 
 from gdata_subm import Gdata
 from libtaxman.collector import BaseCollector
+from libtaxman.config import Option
 from urllib.parse import urlencode
 from urllib.request import urlopen
 
@@ -9,6 +10,11 @@ import logging
 
 
 class SabCollector(BaseCollector):
+    DEFAULT_TIMEOUT = 55
+    SCHEMA = (
+        Option('base_url'),
+        Option('api_key'),
+    )
 
     def get_data_for_sub(self) -> Gdata:
         ret = None
@@ -26,7 +32,7 @@ class SabCollector(BaseCollector):
             # Invert the paused value
             values=[int(not data['queue']['paused'])],
             dsnames=['running'],
-            interval=int(self.config['interval']),
+            interval=self.interval,
         )
 
     def _get_remote_data(self):
@@ -35,12 +41,12 @@ class SabCollector(BaseCollector):
         """
         req_dict = {
             'output': 'json',
-            'apikey': self.config['api_key'],
+            'apikey': self.opts.api_key,
             'mode': 'queue',
         }
-        base = self.config['base_url'].rstrip('/')
+        base = self.opts.base_url.rstrip('/')
         url = f'{base}/api?{urlencode(req_dict)}'
-        res = urlopen(url, timeout=55)
+        res = urlopen(url, timeout=self.timeout)
 
         if res.status < 200 or res.status >= 300:
             logging.error(
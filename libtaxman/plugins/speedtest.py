@@ -1,11 +1,17 @@
 
 from libtaxman.collector import BaseCollector
+from libtaxman.config import Option
 from gdata_subm import Gdata
 import json
 import logging
 import subprocess as sp
 
 class SpeedtestCollector(BaseCollector):
+    DEFAULT_TIMEOUT = 120
+    SCHEMA = (
+        Option('binary', default='/usr/bin/speedtest-cli'),
+        Option('server_id', default=''),
+    )
 
     def get_data_for_sub(self) -> Gdata:
         counters = None
@@ -22,22 +28,23 @@ class SpeedtestCollector(BaseCollector):
             dstypes=['gauge'] * 3,
             values=[counters['download'], counters['upload'], counters['ping']],
             dsnames=['down', 'up', 'ping'],
-            interval=int(self.config['interval']),
+            interval=self.interval,
         )
 
     def _get_counters(self):
         """
         This will get all the current counters from speedtest
         """
-        cmd = [self.config['binary'], '--secure', '--json']
-        if 'server_id' in self.config and self.config['server_id']:
-            cmd.extend(['--server', self.config['server_id']])
+        cmd = [self.opts.binary, '--secure', '--json']
+        if self.opts.server_id:
+            cmd.extend(['--server', self.opts.server_id])
         proc = sp.run(
             cmd,
             stdout=sp.PIPE,
             stderr=sp.PIPE,
             encoding='utf-8',
             errors='replace',
+            timeout=self.timeout,
         )
 
         if proc.returncode != 0:
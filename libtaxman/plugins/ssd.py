@@ -32,7 +32,7 @@ class SSDCollector(BaseCollector):
                 dstypes=['gauge'] * len(data),
                 dsnames=list(data.keys()),
                 values=list(data.values()),
-                interval=int(self.config['interval']),
+                interval=self.interval,
             ))
 
         return ret
@@ -7,7 +7,7 @@ import logging
 from concurrent.futures import ThreadPoolExecutor, wait
 from gdata_subm import Gdata
 from libtaxman.collector import BaseCollector
-from synology_dsm import SynologyDSM
+from libtaxman.config import Option
 from typing import List, Dict, Union
 
 
@@ -26,14 +26,22 @@ class SynologyCollector(BaseCollector):
         ],
         'storage': [],  # This will be done manually
     }
+    SCHEMA = (
+        Option('host'),
+        Option('port', int),
+        Option('username'),
+        Option('password'),
+        Option('data_hostname', default=None),
+    )
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        from synology_dsm import SynologyDSM
         self._conn = SynologyDSM(
-            self.config['host'],
-            self.config['port'],
-            self.config['username'],
-            self.config['password'],
+            self.opts.host,
+            self.opts.port,
+            self.opts.username,
+            self.opts.password,
         )
 
     def get_data_for_sub(self) -> List[Gdata]:
@@ -43,7 +51,7 @@ class SynologyCollector(BaseCollector):
             stats = self._get_stats()
         except Exception as e:
             logging.error(
-                f'Failed to get stats from {self.config["host"]}: {e}')
+                f'Failed to get stats from {self.opts.host}: {e}')
             logging.exception(e)
             return ret
 
@@ -52,8 +60,8 @@ class SynologyCollector(BaseCollector):
             dsnames=list(stats.keys()),
             dstypes=['gauge'] * len(stats),
             values=list(stats.values()),
-            interval=float(self.config['interval']),
-            host=self.config['data_hostname'],
+            interval=self.interval,
+            host=self.opts.data_hostname,
         ))
 
         return ret
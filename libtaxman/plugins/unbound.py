@@ -1,53 +1,101 @@
 
 from libtaxman.collector import BaseCollector
+from libtaxman.config import Option, split_on, to_bool
 from gdata_subm import Gdata
-from unbound_console import RemoteControl
 import logging
 import os
 import re
 import subprocess as sp
+from typing import Iterator, List, Optional, Pattern, Tuple
+
+
+def _to_blocklist(raw: str) -> Optional[Pattern]:
+    """
+    The blocklist is combined into a single regex, so each counter is only
+    searched once
+    """
+    bls = split_on(';')(raw)
+    if not bls:
+        return None
+
+    return re.compile('|'.join(f'(?:{bl})' for bl in bls), re.I)
 
-class UnboundCollector(BaseCollector):
 
-    def get_data_for_sub(self) -> Gdata:
-        counters = None
+class UnboundCollector(BaseCollector):
+    DEFAULT_TIMEOUT = 10
+    SCHEMA = (
+        Option('binary', default='/usr/sbin/unbound-control'),
+        Option('config', default='/etc/unbound/unbound.conf'),
+        Option('use_lib', to_bool, False),
+        Option('ub_server_cert', default=''),
+        Option('ub_client_cert', default=''),
+        Option('ub_client_key', default=''),
+        Option('ub_control_host', default='127.0.0.1'),
+        Option('ub_control_port', int, 953),
+        Option('blocklist', _to_blocklist, None),
+    )
+
+    def get_data_for_sub(self) -> Iterator[Gdata]:
         try:
-            self._set_blocklist()
             counters = self._get_counters()
         except Exception as e:
             logging.exception("Failed to get unbound counters")
+            return
 
         if counters is None:
-            return None
-
+            return
+
+        # With the extended stats, there are a lot of counters, so there's
+        # a Gdata for each group of them (ie. "num.query.*") that is
+        # submitted as soon as it's parsed
+        group = None
+        names, values = [], []
+        for k, v in counters:
+            prefix = k.split('.', maxsplit=1)[0]
+            if prefix != group and names:
+                yield self._get_gdata(names, values)
+                names, values = [], []
+
+            group = prefix
+            names.append(k)
+            values.append(v)
+
+        if names:
+            yield self._get_gdata(names, values)
+
+    def _get_gdata(self, names: List[str], values: List[float]) -> Gdata:
         return Gdata(
             plugin='unbound',
-            dstypes=['gauge'] * len(counters),
-            values=list(counters.values()),
-            dsnames=list(counters.keys()),
-            interval=int(self.config['interval']),
+            dstypes=['gauge'] * len(values),
+            values=values,
+            dsnames=names,
+            interval=self.interval,
         )
 
     def _get_counters(self):
         """
-        This will get all the current counters from the apcaccess binary
+        This will get all the current counters from unbound-control
         """
         counter_str = ''
-        if self.config.getboolean('use_lib'):
+        if self.opts.use_lib:
             counter_str = self._get_counters_lib()
         else:
             counter_str = self._get_counters_bin()
 
+        if counter_str is None:
+            return None
+
         return self._parse_counters(counter_str)
 
     def _get_counters_bin(self):
-        cmd = [self.config['binary'], '-c', self.config['config'], 'stats']
+        cmd = [self.opts.binary, '-c', self.opts.config, 'stats']
         proc = sp.run(
             cmd,
             stdout=sp.PIPE,
             stderr=sp.PIPE,
             encoding='utf-8',
             errors='replace',
+            timeout=self.timeout,
         )
 
         if proc.returncode != 0:
@@ -59,10 +107,12 @@ class UnboundCollector(BaseCollector):
         return proc.stdout
 
     def _get_counters_lib(self):
+        # Only needed when use_lib is set
+        from unbound_console import RemoteControl
         cak = {
-            'srv_cert': self.config['ub_server_cert'],
-            'cl_cert': self.config['ub_client_cert'],
-            'cl_key': self.config['ub_client_key'],
+            'srv_cert': self.opts.ub_server_cert,
+            'cl_cert': self.opts.ub_client_cert,
+            'cl_key': self.opts.ub_client_key,
         }
 
         # Do a path check for the cert/key files and set them to the data
@@ -73,8 +123,8 @@ class UnboundCollector(BaseCollector):
                 cak[k] = os.path.join(self.config['data_dir'], v)
 
         rc = RemoteControl(
-            host=self.config['ub_control_host'],
-            port=self.config.getint('ub_control_port'),
+            host=self.opts.ub_control_host,
+            port=self.opts.ub_control_port,
             server_cert=cak['srv_cert'],
             client_cert=cak['cl_cert'],
             client_key=cak['cl_key'],
@@ -82,33 +132,15 @@ class UnboundCollector(BaseCollector):
 
         return rc.send_command('stats')
 
-    def _parse_counters(self, raw_counters):
-        ret = {}
-
-        for line in raw_counters.split('\n'):
+    def _parse_counters(self, raw_counters) -> Iterator[Tuple[str, float]]:
+        for line in raw_counters.splitlines():
             line = line.strip()
             if not line:
                 continue
 
             k, v = line.split('=', maxsplit=1)
-
-            skip = False
-            for bl in self.blocklist:
-                if bl.search(k):
-                    skip = True
-                    break
-            if skip:
-                continue
-
-            ret[k] = float(v)
-
-        return ret
-
-    def _set_blocklist(self):
-        self.blocklist = []
-        for bl in self.config['blocklist'].split(';'):
-            bl = bl.strip()
-            if not bl:
+            if self.opts.blocklist is not None and \
+                    self.opts.blocklist.search(k):
                 continue
 
-            self.blocklist.append(re.compile(bl, re.I))
+            yield (k, float(v))
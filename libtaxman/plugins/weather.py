@@ -2,6 +2,7 @@
 from collections import defaultdict
 from gdata_subm import Gdata
 from libtaxman.collector import BaseCollector
+from libtaxman.config import Option, one_of, split_on
 from typing import Dict
 from urllib.parse import urlencode
 from urllib.request import urlopen
@@ -12,15 +13,27 @@ import os
 
 
 class WeatherCollector(BaseCollector):
+    SCHEMA = (
+        Option('api_key'),
+        Option('base_url'),
+        Option('base_path'),
+        Option('aqi_path'),
+        Option('data_dir'),
+        Option('data_file'),
+        Option('cities', split_on(';'), ()),
+        Option('city_ids', split_on(';'), ()),
+        Option('units', one_of('standard', 'metric', 'imperial')),
+    )
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._url = '{}/{}'.format(
-            self.config['base_url'].rstrip('/'),
-            self.config['base_path'].rstrip('/'),
+            self.opts.base_url.rstrip('/'),
+            self.opts.base_path.rstrip('/'),
         )
         self._aqi_url = '{}/{}'.format(
-            self.config['base_url'].rstrip('/'),
-            self.config['aqi_path'].rstrip('/'),
+            self.opts.base_url.rstrip('/'),
+            self.opts.aqi_path.rstrip('/'),
         )
 
         self.city_data = defaultdict(list)
@@ -47,7 +60,7 @@ class WeatherCollector(BaseCollector):
             logging.exception(f"Failed to get weather/aqi data: {e}")
             return None
 
-        dtype_inst = 'temp_f' if self.config['units'] == 'imperial' \
+        dtype_inst = 'temp_f' if self.opts.units == 'imperial' \
             else 'temp_c'
 
         ret = [
@@ -57,7 +70,7 @@ class WeatherCollector(BaseCollector):
                 values=[tmp[c]['weather']['main']['temp'] for c in tmp],
                 dsnames=list(tmp.keys()),
                 dtype_instance=dtype_inst,
-                interval=int(self.config['interval']),
+                interval=self.interval,
             ),
         ]
 
@@ -68,7 +81,7 @@ class WeatherCollector(BaseCollector):
                 values=[tmp[c]['aqi'][dtype_inst] for c in tmp],
                 dsnames=list(tmp.keys()),
                 dtype_instance=dtype_inst,
-                interval=int(self.config['interval']),
+                interval=self.interval,
             ))
 
         return ret
@@ -79,8 +92,8 @@ class WeatherCollector(BaseCollector):
         """
         req_dict = {
             'id': city_id,
-            'APPID': self.config['api_key'],
-            'units': self.config['units'],
+            'APPID': self.opts.api_key,
+            'units': self.opts.units,
         }
         url = f'{self._url}?{urlencode(req_dict)}'
         res = urlopen(url, timeout=10)
@@ -96,7 +109,7 @@ class WeatherCollector(BaseCollector):
     def _get_remote_aqi_data(self, lat: float, lon: float) -> Dict[str, float]:
         ret = {}
         req_dict = {
-            'APPID': self.config['api_key'],
+            'APPID': self.opts.api_key,
             'lat': lat,
             'lon': lon,
         }
@@ -122,10 +135,7 @@ class WeatherCollector(BaseCollector):
         """
         Loads the city location data from a file.  This is used for the queries
         """
-        path = os.path.join(
-            self.config['data_dir'],
-            self.config['data_file'],
-        )
+        path = os.path.join(self.opts.data_dir, self.opts.data_file)
         with open(path) as fh:
             for line in fh:
                 o = json.loads(line)
@@ -137,8 +147,7 @@ class WeatherCollector(BaseCollector):
         These are what we will be gathering data for
         """
         # First, get the cities by name
-        city_names = [s.strip() for s in self.config['cities'].split(';')]
-        for city_country in city_names:
+        for city_country in self.opts.cities:
             city, country = [s.strip() for s in city_country.split(',')]
             lcity = city.lower()
             if lcity in self.city_data:
@@ -155,8 +164,7 @@ class WeatherCollector(BaseCollector):
                     'the city data')
 
         # Now go through the ones with explicit IDs
-        city_names = [s.strip() for s in self.config['city_ids'].split(';')]
-        for city_country_id in city_names:
+        for city_country_id in self.opts.city_ids:
             city, country, cid = [s.strip() for s in city_country_id.split(',')]
             lcity = city.lower()
             if lcity in self.city_data:
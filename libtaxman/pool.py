@@ -0,0 +1,79 @@
+#
+# A minimal thread pool for the plugin runs.  Unlike a ThreadPoolExecutor,
+# whose threads are joined at exit, these are daemon threads, so a plugin
+# stuck in a call that never returns can't hold up the shutdown
+#
+
+from queue import Empty, Queue
+from threading import Lock, Semaphore, Thread
+from typing import Callable
+
+import logging
+
+
+class WorkerPool:
+    """
+    Runs the submitted calls on up to max_workers daemon threads.  Threads
+    are only started when there isn't an idle one to take the call
+    """
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        if max_workers < 1:
+            raise ValueError('max_workers must be at least 1')
+
+        self.max_workers = max_workers
+        self.prefix = thread_name_prefix
+        self._q = Queue()
+        self._threads = []
+        self._idle = Semaphore(0)
+        self._lock = Lock()
+        self._shutdown = False
+
+    def submit(self, func: Callable, *args):
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('Cannot submit to a pool after shutdown')
+
+            self._q.put((func, args))
+            if self._idle.acquire(blocking=False) or \
+                    len(self._threads) >= self.max_workers:
+                return
+
+            thread = Thread(
+                target=self._work,
+                name=f'{self.prefix}_{len(self._threads)}',
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self, cancel: bool = False):
+        """
+        Stop the threads once they are done with what is queued, or right
+        after their current call if cancel is set.  This doesn't wait for
+        them
+        """
+        with self._lock:
+            self._shutdown = True
+            if cancel:
+                while True:
+                    try:
+                        self._q.get_nowait()
+                    except Empty:
+                        break
+
+            for _ in self._threads:
+                self._q.put(None)
+
+    def _work(self):
+        while True:
+            item = self._q.get()
+            if item is None:
+                break
+
+            func, args = item
+            try:
+                func(*args)
+            except Exception:
+                logging.exception(f'Uncaught error in {func}')
+
+            self._idle.release()
@@ -0,0 +1,252 @@
+from heapq import heappop, heappush
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+import itertools
+import time
+import zlib
+
+# What to do when a plugin's scheduled run is more than a full interval late
+# (after a stall, a long GC pause or a suspend):
+#   skip    - drop the missed runs and wait for the next slot
+#   once    - run once now to cover everything that was missed
+#   catchup - run every missed slot back-to-back (the old behavior)
+MISSED_RUN_POLICIES = ('skip', 'once', 'catchup')
+
+# How the first run of a plugin is placed within its interval:
+#   none  - run right away, so everything starts in lockstep
+#   hash  - a stable offset derived from the plugin name
+#   cost  - the least loaded offset, based on the measured cost of runs
+#   align - on wall clock boundaries, ie. every 60s interval at :00
+PHASE_MODES = ('none', 'hash', 'cost', 'align')
+
+# How important a plugin's data is, for when the submitter falls behind.  A
+# plugin's runs are skipped while the submission queue is at least this full,
+# as a fraction of its max size:
+#   low    - at half full, ie. for weather and speedtest
+#   normal - at 90% full
+#   high   - never, ie. for the health checks
+PRIORITIES = {'low': 0.5, 'normal': 0.9, 'high': None}
+
+
+def to_exclusion_groups(raw: str) -> Dict[str, Tuple[frozenset, ...]]:
+    """
+    A config converter for the exclusion groups, 1 per line, like:
+
+        <group>: <plugin> ... / <plugin> ...
+
+    The plugins on either side of the "/" never run at the same time as the
+    ones on the other side
+    """
+    ret = {}
+    for line in raw.split('\n'):
+        if not line.strip():
+            continue
+
+        name, _, sides = line.partition(':')
+        sides = sides.split('/')
+        if not name.strip() or len(sides) != 2 or \
+                not all(side.split() for side in sides):
+            raise ValueError(f'Invalid exclusion group "{line.strip()}"')
+
+        ret[name.strip()] = tuple(frozenset(side.split()) for side in sides)
+
+    return ret
+
+
+def next_run(
+        sched: float,
+        interval: float,
+        now: float,
+        policy: str) -> Tuple[float, bool, int]:
+    """
+    Given a run that was due at `sched`, this returns a tuple of the
+    next scheduled time, whether the due run should actually happen and the
+    number of runs that were missed
+    """
+    late = int((now - sched) // interval)
+    if late < 1 or policy == 'catchup':
+        return (sched + interval, True, 0)
+
+    # Stay on the same grid of run times
+    nxt = sched + (late + 1) * interval
+    if policy == 'skip':
+        return (nxt, False, late + 1)
+
+    # Running once now, so don't also run again a moment from now
+    if nxt - now < interval / 2:
+        nxt += interval
+        late += 1
+
+    return (nxt, True, late)
+
+
+def adapt_interval(
+        cur: float,
+        base: float,
+        factor: float,
+        cap: float,
+        stable: bool) -> float:
+    """
+    Returns the next interval for an adaptive plugin.  It grows by factor,
+    up to the cap, for as long as the values are stable and goes right back
+    to the base interval as soon as they aren't
+    """
+    if not stable:
+        return base
+
+    return max(min(cur * factor, cap), base)
+
+
+def is_backlogged(priority: str, depth: int, max_depth: int) -> bool:
+    """
+    Returns whether a plugin with the given priority should skip its runs
+    with the submission queue at depth.  A max_depth of 0 is unbounded
+    """
+    limit = PRIORITIES[priority]
+    if limit is None or max_depth <= 0:
+        return False
+
+    return depth >= limit * max_depth
+
+
+def hash_offset(name: str, interval: float) -> float:
+    """
+    Returns a stable offset within the interval for the given name.  This
+    won't change across restarts, unlike hash()
+    """
+    return (zlib.crc32(name.encode('utf-8')) / 2 ** 32) * interval
+
+
+def align_offset(interval: float, wall_now: float = None) -> float:
+    """
+    Returns the number of seconds until the next wall clock boundary for the
+    interval.  A boundary that is less than half an interval away is
+    skipped, since we are likely running right at the previous one
+    """
+    wall_now = time.time() if wall_now is None else wall_now
+    ret = interval - (wall_now % interval)
+    if ret < interval / 2:
+        ret += interval
+
+    return ret
+
+
+class PhasePlanner:
+    """
+    This spreads plugin runs out in time based on how expensive they are.
+    It keeps a histogram of the cost of the runs starting in each slot over
+    a repeating horizon and places every plugin at the offset that adds the
+    least to the busiest slots
+    """
+    def __init__(self, horizon: int = 3600, slot: float = 1.0):
+        self._slot = slot
+        self._nslots = int(horizon / slot)
+        self._load = [0.0] * self._nslots
+        self._placed = {}
+        self._lock = Lock()
+
+    def place(self, name: str, interval: float, cost: float) -> float:
+        """
+        Place (or re-place) the named plugin and return its offset, in
+        seconds, from the start of the horizon
+        """
+        with self._lock:
+            self._remove(name)
+
+            best = 0
+            best_load = None
+            ncands = min(max(int(interval / self._slot), 1), self._nslots)
+            for cand in range(ncands):
+                load = max(self._load[s] for s in self._slots(cand, interval))
+                if best_load is None or load < best_load:
+                    best, best_load = cand, load
+
+            for s in self._slots(best, interval):
+                self._load[s] += cost
+            self._placed[name] = (best, interval, cost)
+
+            return best * self._slot
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._remove(name)
+
+    def _remove(self, name: str) -> None:
+        if name not in self._placed:
+            return
+
+        start, interval, cost = self._placed.pop(name)
+        for s in self._slots(start, interval):
+            self._load[s] -= cost
+
+    def _slots(self, start: int, interval: float) -> range:
+        step = max(int(interval / self._slot), 1)
+
+        return range(start % self._nslots, self._nslots, step)
+
+
+class Scheduler:
+    """
+    A priority queue of plugin names keyed on their next run time from the
+    monotonic clock.  Rescheduling or removing a plugin just invalidates its
+    old heap entry, so everything is O(log n) and no plugin scans are needed
+    """
+    def __init__(self):
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name: str):
+        return name in self._entries
+
+    def schedule(self, name: str, when: float) -> None:
+        """
+        Schedule (or reschedule) the named plugin to run at `when`
+        """
+        with self._lock:
+            self._invalidate(name)
+            # The counter keeps the ordering stable for identical times
+            entry = [when, next(self._counter), name]
+            self._entries[name] = entry
+            heappush(self._heap, entry)
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._invalidate(name)
+
+    def pop_due(self, now: float) -> List[str]:
+        """
+        Remove and return the names of all plugins due at or before `now`
+        """
+        ret = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                entry = heappop(self._heap)
+                if entry[-1] is None:
+                    continue
+
+                del self._entries[entry[-1]]
+                ret.append(entry[-1])
+
+        return ret
+
+    def next_time(self) -> Optional[float]:
+        """
+        Returns the time of the next scheduled run or None if nothing is
+        scheduled
+        """
+        with self._lock:
+            while self._heap and self._heap[0][-1] is None:
+                heappop(self._heap)
+
+            return self._heap[0][0] if self._heap else None
+
+    def _invalidate(self, name: str) -> None:
+        entry = self._entries.pop(name, None)
+        if entry is not None:
+            entry[-1] = None
@@ -0,0 +1,239 @@
+#
+# This is an on-disk spool for the submissions that couldn't be sent, so they
+# can be replayed once the submission server is back
+#
+
+from threading import Lock
+from typing import List, Optional
+
+import logging
+import os
+import re
+import struct
+import time
+import zlib
+
+# Each record is its length and crc32, followed by the payload
+HEADER = struct.Struct('>II')
+SEG_REG = re.compile(r'^seg-(\d+)\.spool$')
+
+
+class Spool:
+    """
+    An append-only queue of payloads, kept in numbered segment files in a
+    directory.  A torn or corrupt record (ie. from a crash mid-write) fails
+    its checksum and the rest of its segment is skipped.  The oldest
+    segments are dropped to stay under max_bytes, and segments older than
+    max_age seconds are dropped as well.  How far the replay has gotten is
+    saved in a cursor file, so a restart doesn't send everything again
+    """
+    def __init__(
+            self,
+            path: str,
+            max_bytes: int,
+            max_age: float,
+            segment_bytes: int = 4 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # There should be a few segments within the size cap, so it can be
+        # enforced by dropping the oldest ones
+        self.segment_bytes = min(segment_bytes, max(max_bytes // 4, 1))
+        self._lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        self._segs = self._scan()
+        self._last_seq = self._segs[-1] if self._segs else -1
+        self._writer = None
+        self._writer_seq = None
+        # The segment and offset of the next record to replay
+        self._read_seq, self._read_off = self._load_cursor()
+        # The offset after the record returned by peek()
+        self._next_off = None
+
+    def __len__(self):
+        """
+        The number of segments, which is 0 once everything was replayed
+        """
+        with self._lock:
+            return len(self._segs)
+
+    def append(self, payload: bytes):
+        with self._lock:
+            if self._writer is None or \
+                    self._writer.tell() >= self.segment_bytes:
+                self._roll()
+
+            self._writer.write(HEADER.pack(len(payload), zlib.crc32(payload)))
+            self._writer.write(payload)
+            self._writer.flush()
+            self._enforce_size()
+
+    def peek(self) -> Optional[bytes]:
+        """
+        Returns the oldest payload that hasn't been replayed, or None if
+        there isn't one.  It stays in the spool until it's committed
+        """
+        with self._lock:
+            self._expire()
+            while self._segs:
+                seq = self._segs[0]
+                if seq == self._writer_seq:
+                    # New payloads go into a new segment from here on
+                    self._close_writer()
+
+                if seq != self._read_seq:
+                    self._read_seq, self._read_off = seq, 0
+
+                payload = self._read(seq, self._read_off)
+                if payload is not None:
+                    self._next_off = self._read_off + HEADER.size + \
+                        len(payload)
+                    return payload
+
+                self._remove(seq)
+
+            return None
+
+    def commit(self):
+        """
+        Mark the payload from the last peek() as replayed
+        """
+        with self._lock:
+            if self._next_off is None:
+                return
+
+            self._read_off = self._next_off
+            self._next_off = None
+            self._save_cursor()
+
+    def close(self):
+        with self._lock:
+            self._close_writer()
+
+    def _seg_path(self, seq: int) -> str:
+        return os.path.join(self.path, f'seg-{seq:012d}.spool')
+
+    def _scan(self) -> List[int]:
+        ret = []
+        for name in os.listdir(self.path):
+            m = SEG_REG.match(name)
+            if m:
+                ret.append(int(m.group(1)))
+
+        return sorted(ret)
+
+    def _roll(self):
+        self._close_writer()
+        self._last_seq += 1
+        seq = self._last_seq
+        self._writer = open(self._seg_path(seq), 'ab')
+        self._writer_seq = seq
+        self._segs.append(seq)
+
+    def _close_writer(self):
+        if self._writer is None:
+            return
+
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._writer.close()
+        self._writer = None
+        self._writer_seq = None
+
+    def _read(self, seq: int, offset: int) -> Optional[bytes]:
+        """
+        Read the record at the offset, or return None at the end of the
+        segment or if the record is torn or corrupt
+        """
+        path = self._seg_path(seq)
+        try:
+            with open(path, 'rb') as fh:
+                fh.seek(offset)
+                header = fh.read(HEADER.size)
+                if not header:
+                    return None
+
+                if len(header) == HEADER.size:
+                    length, crc = HEADER.unpack(header)
+                    payload = fh.read(length)
+                    if len(payload) == length and \
+                            zlib.crc32(payload) == crc:
+                        return payload
+        except OSError as e:
+            logging.error(f'Failed to read {path}: {e}')
+            return None
+
+        logging.error(
+            f'Skipping the corrupt end of {path}, from offset {offset}')
+
+        return None
+
+    def _remove(self, seq: int):
+        if seq == self._writer_seq:
+            self._close_writer()
+
+        self._segs.remove(seq)
+        try:
+            os.unlink(self._seg_path(seq))
+        except FileNotFoundError:
+            pass
+
+        if seq == self._read_seq:
+            self._read_seq, self._read_off = None, 0
+            self._next_off = None
+            self._save_cursor()
+
+    def _enforce_size(self):
+        total = sum(self._size(seq) for seq in self._segs)
+        while total > self.max_bytes and len(self._segs) > 1:
+            seq = self._segs[0]
+            size = self._size(seq)
+            logging.warning(
+                f'The spool is over {self.max_bytes} bytes, dropping '
+                f'{size} bytes of the oldest data'
+            )
+            self._remove(seq)
+            total -= size
+
+    def _expire(self):
+        cutoff = time.time() - self.max_age
+        for seq in list(self._segs):
+            if seq == self._writer_seq:
+                continue
+
+            try:
+                mtime = os.path.getmtime(self._seg_path(seq))
+            except FileNotFoundError:
+                mtime = 0
+
+            if mtime < cutoff:
+                logging.warning(
+                    f'Dropping spooled data older than {self.max_age}s')
+                self._remove(seq)
+
+    def _size(self, seq: int) -> int:
+        try:
+            return os.path.getsize(self._seg_path(seq))
+        except FileNotFoundError:
+            return 0
+
+    def _load_cursor(self) -> tuple:
+        try:
+            with open(os.path.join(self.path, 'cursor')) as fh:
+                seq, offset = (int(s) for s in fh.read().split())
+        except (OSError, ValueError):
+            return (None, 0)
+
+        if seq not in self._segs:
+            return (None, 0)
+
+        return (seq, offset)
+
+    def _save_cursor(self):
+        path = os.path.join(self.path, 'cursor')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as fh:
+            if self._read_seq is not None:
+                fh.write(f'{self._read_seq} {self._read_off}')
+        # This is atomic, so a crash leaves either the old or the new cursor
+        os.replace(tmp, path)
@@ -1,43 +1,499 @@
 
-from gdata_subm import Gdata, GdataSubmit
+from __future__ import annotations
+
 from libtaxman.config import TaxmanConfig
-from queue import Queue, Empty
+from libtaxman.errors import InvalidConfig
+from libtaxman.spool import Spool
+from queue import Full, Queue, Empty
 from threading import Thread, Event
-from typing import Union, List
+from typing import Union, List, TYPE_CHECKING
+from urllib.parse import urlsplit
 
+import base64
+import copy
+import http.client
+import json
 import logging
+import os
+import time
+
+if TYPE_CHECKING:
+    from gdata_subm import Gdata
+
+
+def identity(gd: Gdata) -> tuple:
+    """
+    Records with the same identity end up under the same keys on the server,
+    apart from their dsnames
+    """
+    return (
+        gd.plugin,
+        gd.plugin_instance,
+        gd.dtype,
+        gd.dtype_instance,
+        gd.host,
+        gd.interval,
+    )
+
+
+def encode(data: List[Gdata]) -> bytes:
+    """
+    Returns the request body for the records, as GdataSubmit builds it.  The
+    record times are set here, so spooled data keeps its original times
+    """
+    return json.dumps(
+        [gd.to_dict() for gd in data if gd is not None]).encode('utf-8')
+
+
+def est_size(gd: Gdata) -> int:
+    """
+    A rough estimate of the size of a record once it's serialized, without
+    actually serializing it
+    """
+    names = sum(len(n) for n in gd.dsnames or ())
+
+    return 200 + names + 30 * len(gd.values)
+
+
+class Batch:
+    """
+    The records for a single request to the server.  A record is merged into
+    an earlier one with the same identity, unless they have a dsname in
+    common (or no dsnames, which means they are both "value")
+    """
+    def __init__(self, max_records: int, max_bytes: int):
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.records = []
+        self.size = 0
+        self.merged = 0
+        # The index of the last record for each identity, and the indexes of
+        # the records that are our own copies
+        self._by_id = {}
+        self._copied = set()
+
+    def __len__(self):
+        return len(self.records)
+
+    def fits(self, gd: Gdata) -> bool:
+        """
+        Whether the record can be added without going over the limits.  An
+        empty batch takes anything, so an oversized record still gets sent
+        """
+        if not self.records:
+            return True
+
+        return len(self.records) < self.max_records and \
+            self.size + est_size(gd) <= self.max_bytes
+
+    def add(self, gd: Gdata):
+        self.size += est_size(gd)
+        key = identity(gd)
+        idx = self._by_id.get(key)
+        if idx is None or not self._can_merge(self.records[idx], gd):
+            self._by_id[key] = len(self.records)
+            self.records.append(gd)
+            return
+
+        if idx not in self._copied:
+            # Merge into a copy rather than change the plugin's record
+            self.records[idx] = self._copy(self.records[idx])
+            self._copied.add(idx)
+
+        prev = self.records[idx]
+        prev.dsnames.extend(gd.dsnames)
+        prev.dstypes.extend(gd.dstypes)
+        prev.values.extend(gd.values)
+        self.merged += 1
+
+    def _copy(self, gd: Gdata) -> Gdata:
+        ret = copy.copy(gd)
+        ret.dsnames = list(gd.dsnames)
+        ret.dstypes = list(gd.dstypes)
+        ret.values = list(gd.values)
+
+        return ret
+
+    def _can_merge(self, prev: Gdata, gd: Gdata) -> bool:
+        if not prev.dsnames or not gd.dsnames:
+            return False
+
+        return not set(prev.dsnames) & set(gd.dsnames)
+
+
+class HttpSender:
+    """
+    This sends records to the submission url like GdataSubmit does, but
+    over a persistent keep-alive connection, instead of a new connection
+    (and TLS handshake) for every request
+    """
+    TIMEOUT = 5
+    # The server refused these for a reason that a retry won't fix, so the
+    # data is dropped rather than spooled
+    FATAL_CODES = frozenset((400, 404, 405, 413, 415, 422))
+
+    def __init__(self, url: str, username: str, password: str):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise InvalidConfig(f'Invalid submission_url: {url}')
+
+        self.url = url
+        self._https = parts.scheme == 'https'
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = parts.path or '/'
+        if parts.query:
+            self._path += f'?{parts.query}'
+
+        token = base64.b64encode(f'{username}:{password}'.encode('utf-8'))
+        self._headers = {
+            'Authorization': f'Basic {token.decode("ascii")}',
+            # This is what GdataSubmit sends, via urllib
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+        self._conn = None
+
+    def send_data(self, data: List[Gdata]) -> bool:
+        if not any(gd is not None for gd in data):
+            return True
+
+        return self.send_body(encode(data))
+
+    def send_body(self, body: bytes) -> bool:
+        """
+        Send an encoded batch.  This returns False if it should be tried
+        again later
+        """
+        for attempt in range(2):
+            reused = self._conn is not None
+            try:
+                status = self._post(body)
+            except (http.client.HTTPException, OSError) as e:
+                self.close()
+                if reused and attempt == 0:
+                    # The server closed the idle connection, so try once
+                    # more on a new one
+                    continue
+
+                logging.error(f'Failed to send data to {self.url}: {e}')
+                return False
+
+            if status in self.FATAL_CODES:
+                logging.error(
+                    f'Sending data returned code: {status}, dropping it')
+            elif status != 200:
+                logging.error(f'Sending data returned code: {status}')
+                return False
+
+            return True
+
+        return False
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _post(self, body: bytes) -> int:
+        if self._conn is None:
+            klass = http.client.HTTPSConnection if self._https else \
+                http.client.HTTPConnection
+            self._conn = klass(self._host, self._port, timeout=self.TIMEOUT)
+
+        self._conn.request('POST', self._path, body, self._headers)
+        resp = self._conn.getresponse()
+        # The connection can only be reused once the response is read
+        resp.read()
+        if resp.will_close:
+            self.close()
+
+        return resp.status
+
+
+class SubmitWorker(Thread):
+    """
+    A thread that sends the batches on its queue, in order, on its own
+    connection.  A None on the queue stops it once everything before it is
+    sent
+    """
+    def __init__(
+            self,
+            sender: HttpSender,
+            idx: int,
+            spool: Spool = None,
+            outage: Event = None):
+        super().__init__(name=f'submit-{idx}')
+        self.sender = sender
+        # If there is a spool, the batches that fail are saved to it, and
+        # during an outage, everything goes straight to it
+        self.spool = spool
+        self.outage = outage
+        # This is small so a slow server backs up into the results queue,
+        # where the manager can see it
+        self.batch_q = Queue(maxsize=2)
+        self.daemon = False
+
+    def run(self):
+        while True:
+            data = self.batch_q.get()
+            if data is None:
+                break
+
+            self._submit_data(data)
+
+        self.sender.close()
+
+    def _submit_data(self, data: Union[Gdata, List[Gdata]]):
+        body = encode(data)
+        if self.spool is not None and self.outage.is_set():
+            self._spool(body)
+            return
+
+        logging.debug('Submitting all data to the server')
+        try:
+            if self.sender.send_body(body):
+                return
+        except Exception as e:
+            logging.error(f'Failed to send data to the server: {e}')
+
+        if self.spool is not None:
+            logging.warning('The submission server is down, spooling data')
+            self.outage.set()
+            self._spool(body)
+
+    def _spool(self, body: bytes):
+        try:
+            self.spool.append(body)
+        except Exception as e:
+            logging.error(f'Failed to spool data, dropping it: {e}')
+            # Nothing is left for the replay to end the outage with, so the
+            # next batch goes to the server to find out if it's back
+            self.outage.clear()
+
+
+class SpoolReplayer(Thread):
+    """
+    This replays the spooled batches, oldest first, at up to `rate` per
+    second, so a recovering server isn't flooded.  While the server is still
+    down, it backs off between attempts, and the first batch that goes
+    through (or an empty spool) ends the outage for the workers
+    """
+    def __init__(
+            self,
+            spool: Spool,
+            sender: HttpSender,
+            outage: Event,
+            rate: float):
+        super().__init__(name='spool-replay')
+        self.spool = spool
+        self.sender = sender
+        self.outage = outage
+        self.rate = rate
+        self.daemon = False
+        self._done = Event()
+
+    def run(self):
+        failures = 0
+        while not self._done.is_set():
+            payload = self.spool.peek()
+            if payload is None:
+                if self.outage.is_set():
+                    # The spool was dropped or couldn't be written, so it's
+                    # up to the workers to find out if the server is back
+                    self.outage.clear()
+                self._done.wait(1)
+                continue
+
+            try:
+                ok = self.sender.send_body(payload)
+            except Exception as e:
+                logging.error(f'Failed to replay spooled data: {e}')
+                ok = False
+
+            if ok:
+                self.spool.commit()
+                failures = 0
+                if self.outage.is_set():
+                    logging.info('The submission server is back')
+                    self.outage.clear()
+                self._done.wait(1 / self.rate)
+            else:
+                failures += 1
+                self._done.wait(min(2 ** failures, 60))
+
+        self.sender.close()
+
+    def stop(self):
+        self._done.set()
+
 
 class Submitter(Thread):
-    def __init__(self, res_q: Queue, config: TaxmanConfig):
+    """
+    This drains the results queue into batches and hands them to
+    submit_workers workers, which send them in parallel.  Each series
+    always goes to the same worker, so its data is sent in order
+    """
+    def __init__(
+            self,
+            res_q: Queue,
+            config: TaxmanConfig,
+            spool: Spool = None):
         super().__init__()
         self.res_q = res_q
         self.config = config
-        self._subm = GdataSubmit(
-            url=self.config['main']['submission_url'],
-            username=self.config['main']['submission_username'],
-            password=self.config['main']['submission_password'],
-        )
+        main = self.config['main']
+        # A spool is handed over from the previous submitter on a reload
+        self.spool = spool if spool is not None else self._get_spool()
+        self.outage = Event()
+        # Everything that is queued within the linger time of the first item
+        # is sent together, up to batch_size records or batch_bytes bytes
+        self.batch_size = main.getint('batch_size', 500)
+        self.batch_bytes = main.getint('batch_bytes', 1024 * 1024)
+        self.linger = main.getfloat('batch_linger', 0.5)
+        self.workers = []
+        for i in range(max(main.getint('submit_workers', 4), 1)):
+            sender = HttpSender(
+                url=main['submission_url'],
+                username=main['submission_username'],
+                password=main['submission_password'],
+            )
+            self.workers.append(
+                SubmitWorker(sender, i, self.spool, self.outage))
+        self.replayer = None
+        if self.spool is not None:
+            self.replayer = SpoolReplayer(
+                self.spool,
+                HttpSender(
+                    url=main['submission_url'],
+                    username=main['submission_username'],
+                    password=main['submission_password'],
+                ),
+                self.outage,
+                main.getfloat('spool_replay_rate', 5.0),
+            )
         self.daemon = False
         self._stop = Event()
+        # This is set when the spool is handed over to a new submitter, so
+        # it isn't closed here
+        self._handed_off = False
 
     def run(self):
+        for worker in self.workers:
+            worker.start()
+        if self.replayer is not None and not self._handed_off:
+            self.replayer.start()
+
         while not self._stop.is_set():
+            self._fill_batches()
+
+        # The workers finish sending (or spooling) what they have before
+        # they exit
+        for worker in self.workers:
+            worker.batch_q.put(None)
+        if self.replayer is not None:
+            self.replayer.stop()
+
+        if self.spool is not None and not self._handed_off:
+            # Everything the workers spool on the way out has to be on disk
+            # before we exit
+            for worker in self.workers:
+                worker.join()
+            self.spool.close()
+
+    def _fill_batches(self):
+        """
+        Route the queued data into a batch per worker, waiting up to the
+        linger time for more to show up, and send them off.  A batch that
+        fills up is sent right away
+        """
+        try:
+            data = self._get_data(0.1)
+        except Empty:
+            # Hit the timeout
+            return
+
+        batches = [self._new_batch() for _ in self.workers]
+        deadline = time.monotonic() + self.linger
+        while True:
+            for gd in data:
+                if gd is None:
+                    continue
+
+                idx = hash(identity(gd)) % len(self.workers)
+                if not batches[idx].fits(gd):
+                    self._send(idx, batches[idx])
+                    batches[idx] = self._new_batch()
+                batches[idx].add(gd)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
             try:
-                data = self.res_q.get(timeout=0.1)
-                if not isinstance(data, (tuple, list)):
-                    data = [data]
+                data = self._get_data(remaining)
             except Empty:
-                # Hit the timeout
-                continue
+                break
 
-            self._submit_data(data)
+        for idx, batch in enumerate(batches):
+            if batch:
+                self._send(idx, batch)
 
-    def _submit_data(self, data: Union[Gdata, List[Gdata]]):
-        logging.debug('Submitting all data to the server')
+    def _get_spool(self) -> Spool:
+        main = self.config['main']
+        if not main.getboolean('spool', True):
+            return None
+
+        path = os.path.join(main['data_dir'], 'spool')
         try:
-            self._subm.send_data(data)
-        except Exception as e:
-            logging.error(f'Failed to send data to the server: {e}')
+            return Spool(
+                path,
+                max_bytes=main.getint('spool_max_bytes', 100 * 1024 * 1024),
+                max_age=main.getfloat('spool_max_age', 86400),
+            )
+        except OSError as e:
+            logging.error(
+                f'Failed to set up the spool in {path}, failed submissions '
+                f'will be dropped: {e}'
+            )
+
+        return None
+
+    def _new_batch(self) -> Batch:
+        return Batch(self.batch_size, self.batch_bytes)
+
+    def _send(self, idx: int, batch: Batch):
+        if batch.merged:
+            logging.debug(f'Merged {batch.merged} records in the batch')
+
+        # This blocks while the worker is behind, but not through a stop
+        while True:
+            try:
+                self.workers[idx].batch_q.put(batch.records, timeout=0.1)
+                return
+            except Full:
+                if self._stop.is_set() and not self.workers[idx].is_alive():
+                    return
+
+    def _get_data(self, timeout: float) -> List[Gdata]:
+        data = self.res_q.get(timeout=timeout)
+        if not isinstance(data, (tuple, list)):
+            data = [data]
+
+        return data
 
     def stop(self):
         self._stop.set()
+
+    def hand_off(self) -> Spool:
+        """
+        Stop, but leave the spool open and return it for a new submitter.
+        This waits for the replayer, so the old and the new one never replay
+        the same batch
+        """
+        self._handed_off = True
+        self.stop()
+        if self.replayer is not None and self.replayer.is_alive():
+            self.replayer.stop()
+            self.replayer.join()
+
+        return self.spool
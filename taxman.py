@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 
+import json
 import logging
 import os
 import sys
 from argparse import ArgumentParser
+from functools import partial
 from libtaxman.config import TaxmanConfig
 from libtaxman.manager import CollectorManager
 from signal import signal, SIGINT, SIGTERM, SIGHUP
@@ -17,6 +19,19 @@ def get_args():
         help='The path to the config file [default: %(default)s]')
     p.add_argument('-D', '--debug', action='store_true', default=False,
         help='Add debug output [default: %(default)s]')
+    p.add_argument('--once', action='store_true', default=False,
+        help='Run each enabled plugin once, in parallel, print the cost '
+        'of each run and exit [default: %(default)s]')
+    p.add_argument('--no-submit', action='store_true', default=False,
+        help='With --once, don\'t submit the collected data '
+        '[default: %(default)s]')
+    p.add_argument('--init-timeout', type=float, default=120,
+        help='With --once, how long to wait for the plugins to initialize '
+        'before reporting the ones that haven\'t as failed, in seconds '
+        '[default: %(default)s]')
+    p.add_argument('--json', action='store_true', default=False,
+        help='With --once, print the results as JSON lines instead of a '
+        'table [default: %(default)s]')
 
     args = p.parse_args()
 
@@ -51,18 +66,74 @@ def sig_handler(num, frame):
     MANAGER.stop()
 
 
-def setup_signals():
-    for sig in (SIGINT, SIGTERM, SIGHUP):
+def hup_handler(args, num, frame):
+    """
+    Re-read the config and let the manager apply only what changed
+    """
+    logging.info(f'Got SIGHUP, reloading {args.config}')
+    try:
+        conf = get_conf(args)
+    except Exception as e:
+        logging.error(f'Failed to read {args.config}, not reloading: {e}')
+        return
+
+    MANAGER.reload(conf)
+
+
+def setup_signals(args):
+    for sig in (SIGINT, SIGTERM):
         signal(sig, sig_handler)
 
+    signal(SIGHUP, partial(hup_handler, args))
+
+
+def print_once(args, results):
+    """
+    Print the results of a --once run
+    """
+    if args.json:
+        for res in results:
+            print(json.dumps(res))
+        return
+
+    fmt = '{:<20} {:>9} {:>9} {:>9} {:>8} {:>8}  {}'
+    print(fmt.format('plugin', 'load(s)', 'wall(s)', 'cpu(s)', 'records',
+        'values', 'error'))
+    for res in results:
+        if 'wall' not in res:
+            print(fmt.format(res['name'], '-', '-', '-', '-', '-',
+                res['error']))
+            continue
+
+        print(fmt.format(
+            res['name'],
+            f'{res["load"]:.3f}',
+            f'{res["wall"]:.3f}',
+            f'{res["cpu"]:.3f}',
+            res['records'],
+            res['values'],
+            res['error'] or '',
+        ))
+
+
+def run_once(args, conf):
+    mgr = CollectorManager(conf, once=True, submit=not args.no_submit)
+    results = mgr.run_once(args.init_timeout)
+    print_once(args, results)
+
+    return 1 if any(res['error'] for res in results) else 0
+
+
 def main():
     global MANAGER
     args = get_args()
     setup_logging(args)
-    setup_signals()
 
     conf = get_conf(args)
-    
+    if args.once:
+        return run_once(args, conf)
+
+    setup_signals(args)
     mgr = CollectorManager(conf)
     MANAGER = mgr
     mgr.run()